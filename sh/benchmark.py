@@ -0,0 +1,364 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import numpy as np
+import cv2
+
+from eye_tracker import EyeTracker
+from detectors import FACE_DETECTORS, face_detector
+from frame_source import open_source
+
+
+STAGES = ('gray', 'face', 'eyes', 'left_pupil', 'right_pupil', 'direction', 'total')
+
+RESOLUTIONS = ('1280x720', '960x540', '640x360')
+
+PUPIL_ENGINES = ('contours', 'components')
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+
+IMAGES_DIR = os.path.join(BENCHMARK_DIR, 'images')
+
+BASELINE = os.path.join(BENCHMARK_DIR, 'benchmarks', 'baseline.json')
+
+
+def percentiles(samples):
+    """
+    Summary in milliseconds of a list of durations in seconds
+    """
+    if len(samples) == 0:
+        return None
+    samples = np.asarray(samples) * 1000
+    p50, p95, p99 = np.percentile(samples, (50, 95, 99))
+    return {"count": len(samples), "mean": float(samples.mean()), "p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+
+def load_eye_crops(directory=IMAGES_DIR):
+    """
+    Bundled fixture frames: the eye crops of the images folder
+    """
+    crops = []
+    for name in sorted(os.listdir(directory)):
+        crop = cv2.imread(os.path.join(directory, name), cv2.IMREAD_COLOR)
+        if crop is not None:
+            crops.append(crop)
+    return crops
+
+
+def _fixture_boxes(crop, i):
+    """
+    Boxes (x, y, w, h) of the left eye, of the right eye and of a face around them in the i-th synthetic frame
+    """
+    h, w = crop.shape[:2]
+    y = 300 + (i % 5)
+    left_eye_bb = (720, y, w, h)
+    right_eye_bb = (560 - w, y, w, h)
+    # the eyes sit in the upper part of the face box, like in a real face
+    face_width = 2 * w + 160 + 80
+    face_bb = (560 - w - 40, y - int(0.3 * face_width), face_width, face_width)
+    return face_bb, left_eye_bb, right_eye_bb
+
+
+def synthetic_frames(eye_crops, count=30):
+    """
+    Full frames built from the eye crops, used when no recording is given:
+    the crops are pasted like a pair of eyes on a plain background
+    """
+    frames = []
+    for i in range(count):
+        crop = eye_crops[i % len(eye_crops)]
+        _, (lx, ly, lw, lh), (rx, ry, rw, rh) = _fixture_boxes(crop, i)
+        frame = np.full((720, 1280, 3), 128, np.uint8)
+        frame[ly:ly+lh, lx:lx+lw] = crop
+        frame[ry:ry+rh, rx:rx+rw] = crop
+        frames.append(frame)
+    return frames
+
+
+def load_frames(source, count):
+    frames = []
+    with open_source(source) as frames_source:
+        for frame in frames_source:
+            frames.append(frame)
+            if len(frames) >= count:
+                break
+    return frames
+
+
+def recorded_eye_crops(frames, **tracker_options):
+    """
+    Eye crops found by the eye tracker in recorded frames, to compare the pupil engines on real eyes
+    """
+    eye_tracker = EyeTracker(**tracker_options)
+    crops = []
+    for frame in frames:
+        eye_tracker.update(frame)
+        for detected, bb in ((eye_tracker.left_eye_detected, eye_tracker.left_eye_bb),
+                             (eye_tracker.right_eye_detected, eye_tracker.right_eye_bb)):
+            if detected:
+                x, y, w, h = bb
+                crops.append(frame[y:y+h, x:x+w].copy())
+    return crops
+
+
+def bench_pipeline(frames, resolution, repeat=1, **tracker_options):
+    """
+    Run the frames through a new EyeTracker at the given resolution and return the statistics of each stage
+    """
+    width, height = (int(v) for v in resolution.split('x'))
+    frames = [cv2.resize(f, (width, height), interpolation=cv2.INTER_AREA) for f in frames]
+
+    eye_tracker = EyeTracker(**tracker_options)
+    # warm up, the first call of the classifiers is slower
+    eye_tracker.update(frames[0])
+
+    samples = {stage: [] for stage in STAGES}
+    hits = 0
+    for _ in range(repeat):
+        for frame in frames:
+            start = time.perf_counter()
+            eye_tracker.update(frame)
+            samples['total'].append(time.perf_counter() - start)
+            for stage, elapsed in eye_tracker.stage_times.items():
+                samples[stage].append(elapsed)
+            hits += eye_tracker.get_looking_direction() is not None
+
+    stats = {stage: percentiles(values) for stage, values in samples.items()}
+    stats['fps'] = len(samples['total']) / sum(samples['total'])
+    stats['direction_rate'] = hits / len(samples['total'])
+    return stats
+
+
+def bench_fixture_stages(eye_crops, repeat=3, count=30, **tracker_options):
+    """
+    Time the eyes, pupil and direction stages on the synthetic frames. They have no face for the classifier,
+    so the face box is set around the pasted crops and, after timing the eye search, the eye boxes on the crops,
+    as if the previous stages had found them. The eye boxes alternate so that the pupil looks left and right
+    """
+    frames = synthetic_frames(eye_crops, count)
+    eye_tracker = EyeTracker(**tracker_options)
+    samples = {stage: [] for stage in STAGES}
+    hits = 0
+    for _ in range(repeat):
+        for i, frame in enumerate(frames):
+            face_bb, left_eye_bb, right_eye_bb = _fixture_boxes(eye_crops[i % len(eye_crops)], i)
+            times = {}
+            eye_tracker.frame = frame
+
+            start = time.perf_counter()
+            eye_tracker.frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            times['gray'] = time.perf_counter() - start
+
+            eye_tracker.face_bb = face_bb
+            start = time.perf_counter()
+            eye_tracker._extract_eyes()
+            times['eyes'] = time.perf_counter() - start
+
+            for position, (x, y, w, h) in (("left", left_eye_bb), ("right", right_eye_bb)):
+                # the pupils of the crops are centered, cutting a side of the box moves them left or right
+                shift = w // 5
+                x, w = (x + shift, w - shift) if i % 2 == 0 else (x, w - shift)
+                setattr(eye_tracker, position + "_eye_bb", (x, y, w, h))
+                setattr(eye_tracker, position + "_eye_frame", frame[y:y+h, x:x+w])
+                setattr(eye_tracker, position + "_eye_detected", True)
+                start = time.perf_counter()
+                eye_tracker._extract_pupil(position)
+                times[position + '_pupil'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            eye_tracker._extract_looking_direction()
+            times['direction'] = time.perf_counter() - start
+
+            times['total'] = sum(times.values())
+            for stage, elapsed in times.items():
+                samples[stage].append(elapsed)
+            hits += eye_tracker.get_looking_direction() is not None
+
+    stats = {stage: percentiles(values) for stage, values in samples.items()}
+    stats['fps'] = len(samples['total']) / sum(samples['total'])
+    stats['direction_rate'] = hits / len(samples['total'])
+    return stats
+
+
+def bench_pupil(eye_crops, repeat=100, reference=None, recorded=False, **tracker_options):
+    """
+    Time _extract_pupil alone, with each eye crop as the whole eye ROI.
+    With a reference engine, it also measures how often both engines agree on the pupil center within 2 pixels.
+    The agreement only means something on the crops of a recording (recorded True), the fixtures are
+    a few processing stages of the same eye and only make it a smoke check
+    """
+    eye_tracker = EyeTracker(**tracker_options)
+    samples = []
+    agreements = []
+    if reference:
+        other = EyeTracker(**dict(tracker_options, pupil_engine=reference))
+        for crop in eye_crops:
+            centers = []
+            for tracker in (eye_tracker, other):
+                h, w = crop.shape[:2]
+                tracker.frame_gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+                tracker.left_eye_bb = (0, 0, w, h)
+                tracker._extract_pupil("left")
+                centers.append(tracker.left_pupil)
+            agreements.append(None not in centers and max(abs(a - b) for a, b in zip(*centers)) <= 2)
+
+    for _ in range(repeat):
+        for crop in eye_crops:
+            h, w = crop.shape[:2]
+            eye_tracker.frame = crop
+            eye_tracker.frame_gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+            eye_tracker.left_eye_bb = (0, 0, w, h)
+            eye_tracker.left_eye_frame = crop
+            eye_tracker.left_eye_detected = True
+            start = time.perf_counter()
+            eye_tracker._extract_pupil("left")
+            samples.append(time.perf_counter() - start)
+
+    stats = percentiles(samples)
+    if agreements:
+        stats['agreement'] = sum(agreements) / len(agreements)
+        stats['agreement_crops'] = "recording" if recorded else "fixtures"
+    return stats
+
+
+def bench_face_detectors(frames, names=FACE_DETECTORS, repeat=1, face_scale=0.5):
+    """
+    Time a full frame face detection with each face detector backend and measure how often it finds a face.
+    Backends whose model files are missing are skipped
+    """
+    results = {}
+    for name in names:
+        detector = face_detector(name)
+        if not detector.available():
+            print("face detector {} skipped, its model files are not in the classifiers folder".format(name))
+            continue
+        eye_tracker = EyeTracker(face_detector=detector, face_scale=face_scale)
+        window = (0, 0, frames[0].shape[1], frames[0].shape[0])
+        samples = []
+        hits = 0
+        for i in range(repeat + 1):
+            for frame in frames:
+                eye_tracker.frame_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                start = time.perf_counter()
+                face = eye_tracker._detect_face(window)
+                elapsed = time.perf_counter() - start
+                # the first pass warms up the detector
+                if i > 0:
+                    samples.append(elapsed)
+                    hits += face is not None
+        results['face@' + name] = {"detect": percentiles(samples), "hit_rate": hits / len(samples)}
+    return results
+
+
+def compare(results, baseline, tolerance, min_delta=0.05):
+    """
+    Return the list of regressions of the results w.r.t. the baseline: p50 and p95 slower or fps lower than the tolerance.
+    Slowdowns smaller than min_delta milliseconds are timer noise and ignored
+    """
+    regressions = []
+    for name, stats in results.items():
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        if 'fps' in stats and stats['fps'] < reference['fps'] * (1 - tolerance):
+            regressions.append("{} fps: {:.1f} < {:.1f}".format(name, stats['fps'], reference['fps']))
+        for stage, values in stats.items():
+            if not isinstance(values, dict) or not isinstance(reference.get(stage), dict):
+                continue
+            for p in ('p50', 'p95'):
+                if values[p] > reference[stage][p] * (1 + tolerance) + min_delta:
+                    regressions.append("{} {} {}: {:.3f} ms > {:.3f} ms".format(name, stage, p, values[p], reference[stage][p]))
+    return regressions
+
+
+def print_stats(name, stats):
+    print(name)
+    if 'fps' in stats:
+        print("  {:.1f} fps, direction found in {:.0%} of the frames".format(stats['fps'], stats['direction_rate']))
+        rows = [(stage, stats[stage]) for stage in STAGES]
+    elif 'hit_rate' in stats:
+        print("  face found in {:.0%} of the frames".format(stats['hit_rate']))
+        rows = [('detect', stats['detect'])]
+    else:
+        if 'agreement' in stats:
+            if stats['agreement_crops'] == "recording":
+                print("  same pupil center as {} in {:.0%} of the eye crops of the recording".format(PUPIL_ENGINES[0], stats['agreement']))
+            else:
+                print("  same pupil center as {} in {:.0%} of the fixture crops (smoke check only, use -s for a real agreement)".format(
+                    PUPIL_ENGINES[0], stats['agreement']))
+        rows = [('pupil', stats)]
+    for stage, values in rows:
+        if values:
+            print("  {:12s} p50 {:8.3f} ms  p95 {:8.3f} ms  p99 {:8.3f} ms  ({} samples)".format(
+                stage, values['p50'], values['p95'], values['p99'], values['count']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage latency benchmark of the eye tracker")
+    parser.add_argument("-s", "--source", default=None, help="video file or directory of recorded frames (default synthetic frames from the images folder)")
+    parser.add_argument("-n", "--frames", type=int, default=100, help="maximum number of frames read from the source")
+    parser.add_argument("-r", "--resolutions", nargs="+", default=RESOLUTIONS, help="frame resolutions as WIDTHxHEIGHT")
+    parser.add_argument("--repeat", type=int, default=3, help="number of passes over the frames")
+    parser.add_argument("-p", "--pupil-engine", default=PUPIL_ENGINES[0], choices=PUPIL_ENGINES, help="pupil engine of the pipeline")
+    parser.add_argument("-f", "--face-detector", default="haar", choices=list(FACE_DETECTORS), help="face detector backend of the pipeline")
+    parser.add_argument("--detectors", action="store_true", help="compare the speed and the hit rate of the face detector backends")
+    parser.add_argument("--full-detection", action="store_true", help="disable face tracking and scan the whole frame every time")
+    parser.add_argument("-b", "--baseline", default=BASELINE, help="baseline file")
+    parser.add_argument("--save", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--check", action="store_true", help="fail if the results regress w.r.t. the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown w.r.t. the baseline")
+    args = parser.parse_args()
+    # the timings depend on the machine, so no baseline is shipped, each station saves its own
+    if args.check and not args.save and not os.path.isfile(args.baseline):
+        parser.error("no baseline in {}, run the benchmark with --save first".format(args.baseline))
+
+    eye_crops = load_eye_crops()
+    if args.source:
+        frames = load_frames(args.source, args.frames)
+    else:
+        frames = synthetic_frames(eye_crops)
+
+    results = {}
+    for resolution in args.resolutions:
+        results['pipeline@' + resolution] = bench_pipeline(frames, resolution, args.repeat, face_tracking=not args.full_detection,
+                                                            pupil_engine=args.pupil_engine, face_detector=args.face_detector)
+    if not args.source:
+        # the synthetic frames have no face, so the pipeline above stops at the face stage
+        results['stages@fixtures'] = bench_fixture_stages(eye_crops, args.repeat, pupil_engine=args.pupil_engine)
+    # the pupil engines are compared on the eyes of the recording, when the tracker finds some
+    pupil_crops = recorded_eye_crops(frames, face_detector=args.face_detector) if args.source else []
+    if args.source and not pupil_crops:
+        print("no eyes found in {}, the pupil engines are compared on the fixture crops".format(args.source))
+    for engine in PUPIL_ENGINES:
+        results['pupil@' + engine] = bench_pupil(pupil_crops or eye_crops, pupil_engine=engine, recorded=bool(pupil_crops),
+                                                 reference=PUPIL_ENGINES[0] if engine != PUPIL_ENGINES[0] else None)
+
+    if args.detectors:
+        results.update(bench_face_detectors(frames, repeat=args.repeat))
+
+    for name, stats in results.items():
+        print_stats(name, stats)
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump({"machine": platform.node(), "python": platform.python_version(), "opencv": cv2.__version__,
+                       "source": args.source or "synthetic", "results": results}, f, indent=2)
+        print("baseline saved to {}".format(args.baseline))
+
+    if args.check:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline['results'], args.tolerance)
+        for regression in regressions:
+            print("REGRESSION: " + regression)
+        if regressions:
+            sys.exit(1)
+        print("no regressions w.r.t. {}".format(args.baseline))
+
+
+if __name__ == '__main__':
+    main()
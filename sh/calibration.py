@@ -0,0 +1,146 @@
+import cv2
+import numpy as np
+
+from eye_tracker import binarize_eye
+
+
+def eye_rois(eye_tracker):
+    """
+    Equalized gray eye ROIs of the last frame analyzed by the eye tracker
+    """
+    rois = []
+    for bb in (eye_tracker.left_eye_bb, eye_tracker.right_eye_bb):
+        if bb is None:
+            continue
+        x, y, w, h = bb
+        roi = eye_tracker.frame_gray[y:y+h, x:x+w]
+        if roi.size > 0:
+            rois.append(cv2.equalizeHist(roi))
+    return rois
+
+
+def pupil_score(eye_frame_th):
+    """
+    How much the binarized eye looks like it contains a pupil, between 0 and 1, and the blob center.
+    The biggest dark blob must be round, must not touch the eye borders and must cover a plausible part of the eye
+    """
+    height, width = eye_frame_th.shape
+    n, _, stats, centroids = cv2.connectedComponentsWithStats(cv2.bitwise_not(eye_frame_th), connectivity=8, ltype=cv2.CV_16U)
+    if n < 2:
+        return 0.0, None
+
+    best = stats[1:, cv2.CC_STAT_AREA].argmax() + 1
+    x, y, w, h, area = stats[best]
+
+    if x == 0 or y == 0 or x + w == width or y + h == height:
+        return 0.0, None
+
+    fraction = area / (width * height)
+    if fraction < 0.01 or fraction > 0.25:
+        return 0.0, None
+
+    # an ellipse fills pi/4 of its bounding box, a round one has the same width and height
+    fill = min(area / (np.pi / 4 * w * h), 1.0)
+    aspect = min(w, h) / max(w, h)
+    return fill * aspect, centroids[best] / (width, height)
+
+
+class ThresholdCalibrator:
+    """
+    Automatic calibration of the pupil binarization threshold of an EyeTracker.
+    During calibration it collects the eye ROIs of the first frames with eyes,
+    then it picks the threshold giving round and stable pupil blobs and keeps it for the session.
+    Afterwards it slowly follows the lighting drift trying the thresholds next to the current one
+    Attributes:
+        candidates: thresholds tried during calibration
+        calibration_frames: number of frames with eyes used for calibration
+        adapt_every: number of frames between two adaptation steps, 0 to disable adaptation
+        adapt_step: distance of the thresholds tried during adaptation
+        drift: weight of a new adaptation step on the threshold
+        threshold: calibrated threshold, None until the calibration is completed
+        calibrating: True while collecting eye ROIs for calibration
+
+    Methods:
+        start: start a new calibration, discarding the cached threshold
+        update: feed the last frame analyzed by the eye tracker, it sets the eye tracker threshold when calibrated
+    """
+    def __init__(self, candidates=range(5, 121, 5), calibration_frames=15, adapt_every=30, adapt_step=5, drift=0.1):
+        self.candidates = list(candidates)
+        self.calibration_frames = calibration_frames
+        self.adapt_every = adapt_every
+        self.adapt_step = adapt_step
+        self.drift = drift
+
+        self.threshold = None
+        self.calibrating = False
+        self._rois = []
+        self._frames = 0
+        self._level = None
+
+        self.start()
+
+    def start(self):
+        self.threshold = None
+        self.calibrating = True
+        self._rois = []
+        self._frames = 0
+
+    def set_threshold(self, threshold):
+        """
+        Use a threshold chosen by hand, stopping any calibration in progress
+        """
+        self.threshold = threshold
+        self._level = float(threshold)
+        self.calibrating = False
+        self._rois = []
+
+    def score(self, threshold, rois):
+        """
+        Score of a threshold over a list of eye ROIs: mean roundness of the pupil blobs,
+        reduced when the blobs are missing or their centers jump between ROIs
+        """
+        scores = []
+        centers = []
+        for roi in rois:
+            score, center = pupil_score(binarize_eye(roi, threshold))
+            scores.append(score)
+            if center is not None:
+                centers.append(center)
+        if len(scores) == 0:
+            return 0.0
+        stability = 1.0
+        if len(centers) > 1:
+            stability = max(0.0, 1.0 - 4 * float(np.asarray(centers).std(axis=0).mean()))
+        return float(np.mean(scores)) * stability
+
+    def update(self, eye_tracker):
+        # a frame predicted by the gaze filter has no eye ROIs of its own
+        if not eye_tracker.analyzed:
+            return
+        rois = eye_rois(eye_tracker)
+
+        if self.calibrating:
+            if rois:
+                self._rois.extend(rois)
+                self._frames += 1
+            if self._frames >= self.calibration_frames:
+                scores = [self.score(threshold, self._rois) for threshold in self.candidates]
+                if max(scores) > 0:
+                    self.set_threshold(self.candidates[int(np.argmax(scores))])
+                else:
+                    # nothing looks like a pupil yet, try again on the next frames
+                    self._rois = []
+                    self._frames = 0
+
+        elif self.threshold is not None and self.adapt_every and rois:
+            self._frames += 1
+            if self._frames % self.adapt_every == 0:
+                candidates = [self.threshold - self.adapt_step, self.threshold, self.threshold + self.adapt_step]
+                scores = [self.score(threshold, rois) if 0 < threshold < 255 else -1 for threshold in candidates]
+                best = candidates[int(np.argmax(scores))]
+                # move slowly towards the best threshold, a single frame can not change it much
+                self._level = (1 - self.drift) * self._level + self.drift * best
+                self.threshold = int(round(self._level))
+
+        if self.threshold is not None:
+            eye_tracker.threshold = self.threshold
@@ -0,0 +1,93 @@
+import time
+import threading
+from collections import deque
+
+from frame_source import FrameSource
+
+
+class ThreadedCapture(FrameSource):
+    """
+    Frame source that reads another source in a background thread and always hands out the newest frame
+    Attributes:
+        source: the wrapped frame source
+        buffer_size: number of frames kept in the ring buffer
+        captured_frames: number of frames read from the source
+        dropped_frames: number of frames captured but never handed out because a newer one was available
+        frame_time: monotonic time at which the last returned frame was captured
+        exhausted: True once the wrapped source has no more frames
+
+    Methods:
+        start: start the capture thread
+        read: return a tuple (ok, frame) with the newest frame not returned yet, waiting for it if needed
+        release: stop the capture thread and release the source
+    """
+    def __init__(self, source, buffer_size=2):
+        super().__init__()
+        self.source = source
+        self.buffer_size = buffer_size
+        self.captured_frames = 0
+        self.dropped_frames = 0
+        self.frame_time = None
+
+        self._buffer = deque(maxlen=buffer_size)
+        self._condition = threading.Condition()
+        self._running = False
+        self.exhausted = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._running = True
+            self._thread = threading.Thread(target=self._capture, name="capture", daemon=True)
+            self._thread.start()
+        return self
+
+    def _capture(self):
+        while self._running:
+            ok, frame = self.source.read()
+            now = time.monotonic()
+            with self._condition:
+                if not ok:
+                    self.exhausted = True
+                    self._condition.notify_all()
+                    return
+                if len(self._buffer) == self.buffer_size:
+                    # the oldest frame is overwritten before anyone read it
+                    self.dropped_frames += 1
+                self._buffer.append((now, frame))
+                self.captured_frames += 1
+                self._condition.notify_all()
+
+    def _read(self, timeout=None):
+        self.start()
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._buffer or self.exhausted, timeout):
+                return False, None
+            if not self._buffer:
+                return False, None
+
+            # skip stale frames and keep the newest one
+            self.dropped_frames += len(self._buffer) - 1
+            self.frame_time, frame = self._buffer.pop()
+            self._buffer.clear()
+        return True, frame
+
+    def read(self, timeout=None):
+        ok, frame = self._read(timeout)
+        if ok:
+            self.frame_index += 1
+        return ok, frame
+
+    def frame_age(self):
+        """
+        Seconds elapsed since the last returned frame was captured
+        """
+        if self.frame_time is None:
+            return None
+        return time.monotonic() - self.frame_time
+
+    def release(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(timeout=1)
+        self.source.release()
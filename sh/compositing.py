@@ -0,0 +1,97 @@
+import os
+import time
+import numpy as np
+import cv2
+
+
+def blend(background, foreground, offset_x=0, offset_y=0):
+    """
+    Alpha blend in place a BGRA foreground image over a BGRA background image,
+    with the top-left corner of the foreground at (offset_x, offset_y).
+    The foreground is clipped to the background borders, offsets can be negative.
+    All the math is done on integers with OpenCV saturated arithmetic,
+    results differ by at most 1 from the float formula
+    """
+    height, width = foreground.shape[:2]
+    bg_height, bg_width = background.shape[:2]
+
+    # clip the foreground to the background
+    x0, y0 = max(offset_x, 0), max(offset_y, 0)
+    x1, y1 = min(offset_x + width, bg_width), min(offset_y + height, bg_height)
+    if x0 >= x1 or y0 >= y1:
+        return background
+
+    bg = background[y0:y1, x0:x1]
+    fg = foreground[y0 - offset_y:y1 - offset_y, x0 - offset_x:x1 - offset_x]
+
+    alpha_fg = fg[:,:,3]
+    alpha_bg = bg[:,:,3]
+    alpha_fg4 = cv2.merge((alpha_fg, alpha_fg, alpha_fg, alpha_fg))
+    inv_alpha_fg4 = cv2.bitwise_not(alpha_fg4)
+    inv_alpha_bg = cv2.bitwise_not(alpha_bg)
+
+    # color = a_fg * fg + a_bg * bg * (1 - a_fg)
+    if cv2.countNonZero(inv_alpha_bg) == 0:
+        # opaque background, the usual case of the screen
+        blended = cv2.add(cv2.multiply(fg, alpha_fg4, scale=1/255), cv2.multiply(bg, inv_alpha_fg4, scale=1/255))
+    else:
+        alpha_bg4 = cv2.merge((alpha_bg, alpha_bg, alpha_bg, alpha_bg))
+        color_fg = cv2.multiply(fg, alpha_fg4, dtype=cv2.CV_32S)
+        color_bg = cv2.multiply(cv2.multiply(bg, alpha_bg4, dtype=cv2.CV_32S), inv_alpha_fg4, scale=1/255, dtype=cv2.CV_32S)
+        blended = cv2.convertScaleAbs(cv2.add(color_fg, color_bg), alpha=1/255)
+
+    # alpha = 1 - (1 - a_fg) * (1 - a_bg)
+    blended[:,:,3] = cv2.bitwise_not(cv2.multiply(inv_alpha_fg4[:,:,0], inv_alpha_bg, scale=1/255))
+
+    bg[:] = blended
+    return background
+
+
+def _blend_float(background, foreground, offset_x=0, offset_y=0):
+    """
+    Previous float implementation of the Screen alpha blending, kept as reference for the benchmark
+    """
+    height, width = foreground.shape[:2]
+    background = background[offset_y:offset_y + height, offset_x:offset_x + width, :]
+
+    # normalize alpha channels from 0-255 to 0-1
+    alpha_background = background[:,:,3] / 255.0
+    alpha_foreground = foreground[:,:,3] / 255.0
+
+    # set adjusted colors
+    for color in range(0, 3):
+        background[:,:,color] = alpha_foreground * foreground[:,:,color] + alpha_background * background[:,:,color] * (1 - alpha_foreground)
+
+    # set adjusted alpha and denormalize back to 0-255
+    background[:,:,3] = (1 - (1 - alpha_foreground) * (1 - alpha_background)) * 255
+
+
+def benchmark(repeat=200):
+    """
+    Compare the integer blending with the float one on the bundled resources
+    """
+    background_color = (200,225,240, 255)
+    for name in ('sorting_hat', 'gryffindor', 'hufflepuff', 'ravenclaw', 'slytherin'):
+        image = cv2.imread(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resources', name + '.png'), cv2.IMREAD_UNCHANGED)
+        if image is None:
+            continue
+        height, width = image.shape[:2]
+        canvas = np.empty((height, width, 4), np.uint8)
+
+        timings = {}
+        outputs = {}
+        for label, function in (('float', _blend_float), ('integer', blend)):
+            start = time.perf_counter()
+            for _ in range(repeat):
+                canvas[:] = background_color
+                function(canvas, image)
+            timings[label] = (time.perf_counter() - start) / repeat * 1000
+            outputs[label] = canvas.copy()
+
+        diff = np.abs(outputs['float'].astype(int) - outputs['integer']).max()
+        print("{:12s} {}x{}: float {:.3f} ms, integer {:.3f} ms ({:.1f}x), max diff {}".format(
+            name, width, height, timings['float'], timings['integer'], timings['float'] / timings['integer'], diff))
+
+
+if __name__ == '__main__':
+    benchmark()
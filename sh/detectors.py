@@ -0,0 +1,148 @@
+import os
+import threading
+import cv2
+import numpy as np
+
+
+CLASSIFIERS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'classifiers')
+
+# opencv models keep per-image state, so each thread gets its own copy, shared by all its trackers
+_models = threading.local()
+
+
+def _load(key, loader):
+    cache = getattr(_models, 'cache', None)
+    if cache is None:
+        cache = _models.cache = {}
+    if key not in cache:
+        cache[key] = loader()
+    return cache[key]
+
+
+def load_cascade(name):
+    """
+    Return the classifier classifiers/<name>, parsed only the first time in each thread
+    """
+    def loader():
+        path = os.path.join(CLASSIFIERS_DIR, name)
+        cascade = cv2.CascadeClassifier(path)
+        if cascade.empty():
+            raise IOError("can not load the classifier {}".format(path))
+        return cascade
+    return _load(name, loader)
+
+
+class CascadeDetector:
+    """
+    Detector based on an opencv cascade of the classifiers folder, Haar or LBP
+    Attributes:
+        name: file name of the cascade
+        scale_factor, min_neighbors: detectMultiScale parameters
+
+    Methods:
+        available: True if the cascade file exists
+        detect: list of the boxes (x, y, w, h) found in a gray image
+    """
+    def __init__(self, name, scale_factor=1.3, min_neighbors=5):
+        self.name = name
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+
+    def available(self):
+        return os.path.isfile(os.path.join(CLASSIFIERS_DIR, self.name))
+
+    def detect(self, image_gray, min_size=None, max_size=None):
+        options = {}
+        if min_size:
+            options['minSize'] = min_size
+        if max_size:
+            options['maxSize'] = max_size
+        return load_cascade(self.name).detectMultiScale(image_gray, self.scale_factor, self.min_neighbors, **options)
+
+
+class DnnFaceDetector:
+    """
+    Face detector based on the opencv DNN module with a local SSD model (Caffe format), run on the cpu
+    Attributes:
+        config, model: file names of the network description and of the weights in the classifiers folder
+        confidence: minimum confidence of a detected face
+        input_size: side of the square image given to the network
+
+    Methods:
+        available: True if the model files exist
+        detect: list of the boxes (x, y, w, h) found in a gray image
+    """
+    def __init__(self, config='deploy.prototxt', model='res10_300x300_ssd_iter_140000.caffemodel', confidence=0.5, input_size=300):
+        self.config = config
+        self.model = model
+        self.confidence = confidence
+        self.input_size = input_size
+
+    def available(self):
+        return all(os.path.isfile(os.path.join(CLASSIFIERS_DIR, name)) for name in (self.config, self.model))
+
+    def _net(self):
+        def loader():
+            if not self.available():
+                raise IOError("can not load the face model {} and {} from {}".format(self.config, self.model, CLASSIFIERS_DIR))
+            net = cv2.dnn.readNetFromCaffe(os.path.join(CLASSIFIERS_DIR, self.config), os.path.join(CLASSIFIERS_DIR, self.model))
+            net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            net.setPreferableTarget(cv2.dnn.DNN_TARGET_CPU)
+            return net
+        return _load((self.config, self.model), loader)
+
+    def detect(self, image_gray, min_size=None, max_size=None):
+        height, width = image_gray.shape[:2]
+        # the network was trained on color images
+        image = cv2.cvtColor(image_gray, cv2.COLOR_GRAY2BGR)
+        blob = cv2.dnn.blobFromImage(image, 1.0, (self.input_size, self.input_size), (104, 177, 123))
+        net = self._net()
+        net.setInput(blob)
+        detections = net.forward()[0, 0]
+
+        faces = []
+        for confidence, x0, y0, x1, y1 in detections[:, 2:7]:
+            if confidence < self.confidence:
+                continue
+            x0, x1 = int(max(x0, 0) * width), int(min(x1, 1) * width)
+            y0, y1 = int(max(y0, 0) * height), int(min(y1, 1) * height)
+            w, h = x1 - x0, y1 - y0
+            if w <= 0 or h <= 0:
+                continue
+            if min_size and (w < min_size[0] or h < min_size[1]):
+                continue
+            if max_size and (w > max_size[0] or h > max_size[1]):
+                continue
+            faces.append((x0, y0, w, h))
+        return np.array(faces, int).reshape(-1, 4)
+
+
+FACE_DETECTORS = {
+    "haar": lambda: CascadeDetector('haarcascade_frontalface_default.xml'),
+    "haar_alt": lambda: CascadeDetector('haarcascade_frontalface_alt.xml'),
+    "lbp": lambda: CascadeDetector('lbpcascade_frontalface_improved.xml'),
+    "dnn": lambda: DnnFaceDetector(),
+}
+
+EYE_DETECTORS = {
+    "haar": lambda: CascadeDetector('haarcascade_eye_tree_eyeglasses.xml'),
+    "haar_plain": lambda: CascadeDetector('haarcascade_eye.xml'),
+}
+
+
+def face_detector(name):
+    """
+    Face detector of the given backend name (see FACE_DETECTORS)
+    """
+    if name not in FACE_DETECTORS:
+        raise ValueError("unknown face detector {}, choose one of {}".format(name, ", ".join(FACE_DETECTORS)))
+    return FACE_DETECTORS[name]()
+
+
+def eye_detector(name):
+    """
+    Eye detector of the given backend name (see EYE_DETECTORS)
+    """
+    if name not in EYE_DETECTORS:
+        raise ValueError("unknown eye detector {}, choose one of {}".format(name, ", ".join(EYE_DETECTORS)))
+    return EYE_DETECTORS[name]()
@@ -1,33 +1,131 @@
 import os
+import copy
+import time
 import cv2
 import math
 import numpy as np
-from model import Eye
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from model import Eye, FrameResult, RESULT_DTYPE
+import detectors
+
+# vertical band of the face, as fractions of its height, and range of eye sizes, as fractions of its width
+EYE_BAND = (0.1, 0.65)
+EYE_SIZE = (0.1, 0.5)
+
+
+def _downscale(image, scale):
+    """
+    Resize an image by a scale factor, returning the image itself at scale 1
+    """
+    if scale == 1:
+        return image
+    height, width = image.shape[:2]
+    size = (max(int(width * scale), 1), max(int(height * scale), 1))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+def _blur_kernel(scale):
+    """
+    Gaussian kernel equivalent to the 7x7 one used at full resolution
+    """
+    k = max(int(7 * scale) | 1, 3)
+    return (k, k)
+
+
+def _ints(values):
+    if values is None:
+        return None
+    return tuple(int(v) for v in values)
+
+
+def _batches(frames, chunk_size):
+    """
+    Split frames in chunks of at most chunk_size frames: frames can be an N x H x W x 3 array or an iterable
+    of such arrays, of lists of frames or of single frames. The arrays are split in views without copies,
+    the single frames are grouped in lists of chunk_size
+    """
+    if isinstance(frames, np.ndarray) and frames.ndim == 4:
+        frames = [frames]
+    pending = []
+    for chunk in frames:
+        if isinstance(chunk, np.ndarray) and chunk.ndim == 3:
+            pending.append(chunk)
+            if len(pending) == chunk_size:
+                yield pending
+                pending = []
+            continue
+        if pending:
+            yield pending
+            pending = []
+        for i in range(0, len(chunk), chunk_size):
+            yield chunk[i:i+chunk_size]
+    if pending:
+        yield pending
+
+
+def binarize_eye(eye_frame_gray, threshold):
+    """
+    Binarize an equalized gray eye frame: the pupil and the other dark areas are black, the rest is white
+    """
+    _, eye_frame_th = cv2.threshold(eye_frame_gray, threshold, 255, cv2.THRESH_BINARY)
+
+##    cv2.imwrite("images/02_eye_frame_threshold.png", eye_frame_th)
+
+    eye_frame_th = cv2.erode(eye_frame_th, None, iterations=2)
+    eye_frame_th = cv2.dilate(eye_frame_th, None, iterations=4)
+
+    eye_frame_th = cv2.medianBlur(eye_frame_th, 7)
+
+##    cv2.imwrite("images/03_eye_frame_medianBlur.png", eye_frame_th)
+
+    return eye_frame_th
+
 
 class EyeTracker():
     """
     EyeTracker implementation based on threshold using OpenCV
     Attributes:
-        face_cascade: opencv face classifier
-        eye_cascade: opencv eye classifier
+        face_detector: face detector backend, a detectors.FACE_DETECTORS name or a detector object
+        eye_detector: eye detector backend, a detectors.EYE_DETECTORS name or a detector object
         frame: current frame in numpy format
         frame_gray: current frame in gray scale in numpy format
         looking_direction: current looking direction as string (left or right)
+        stage_times: time in seconds spent in each stage of the last analysis
+        threshold: binarization threshold used to extract the pupil
+        face_tracking: if True the face is searched around the previous one instead of the whole frame
+        redetect_interval: number of tracked frames after which the whole frame is scanned again
+        tracking_padding: fraction of the face size added on each side of the tracking window
+        max_face_backoff: maximum number of frames between two full scans while no face is present
+        gaze_filter: optional GazeFilter smoothing the pupil positions, the looking direction then comes from the filter
+        detect_every: with a gaze filter, the pipeline runs every detect_every frames and the other frames are predicted
+        min_confidence: with a gaze filter, the pipeline runs anyway when the prediction confidence is lower than this
+        analyzed: False if the last frame was predicted by the gaze filter instead of analyzed
+        history: optional ResultHistory where the result of every frame is appended
+        pupil_engine: "contours" to extract the pupil from the contours of the thresholded eye, "components" from its connected components
+        face_scale: resolution scale of the frame used for face detection
+        eye_scale: resolution scale of the face ROI used for eye detection, pupils always use full resolution
 
     Methods:
         update: update the frame with the one just captured from camera and analize it
+        update_batch: analyze a stack of recorded frames and return an array of RESULT_DTYPE records
         decorate_frame: highlighs and draws the features extracted from face on the frme and return a copy of it
-        left_eye: return an object for the left eye with the extracted features
-        right_eye: return an object for the right eye with the extracted features
+        left_eye: return an object for the left eye with the extracted features, its frame is a view valid until the next update
+        right_eye: return an object for the right eye with the extracted features, its frame is a view valid until the next update
+        result: return a FrameResult with the features extracted from the last frame
         get_looking_direction: return the current looking direction as string
 
     """
-    def __init__(self):
-        # initialize the opencv classifier for face and eye detection
-        self.face_cascade = cv2.CascadeClassifier(os.path.join('classifiers', 'haarcascade_frontalface_default.xml'))
-#        self.face_cascade = cv2.CascadeClassifier(os.path.join('classifiers', 'haarcascade_frontalface_alt.xml'))
-#        self.eye_cascade = cv2.CascadeClassifier(os.path.join('classifiers', 'haarcascade_eye.xml'))
-        self.eye_cascade = cv2.CascadeClassifier(os.path.join('classifiers', 'haarcascade_eye_tree_eyeglasses.xml'))
+    def __init__(self, threshold=25, face_tracking=True, redetect_interval=10, tracking_padding=0.25, max_face_backoff=8,
+                 face_scale=0.5, eye_scale=0.75, pupil_engine="contours", gaze_filter=None, detect_every=1, min_confidence=0.5,
+                 history=None, face_detector="haar", eye_detector="haar"):
+        # initialize the detectors for face and eye detection, their models are loaded at the first use
+        if isinstance(face_detector, str):
+            face_detector = detectors.face_detector(face_detector)
+        if isinstance(eye_detector, str):
+            eye_detector = detectors.eye_detector(eye_detector)
+        self.face_detector = face_detector
+        self.eye_detector = eye_detector
 
         # FOR BLOB DETECION VERSION
 #        detector_params = cv2.SimpleBlobDetector_Params()
@@ -69,36 +167,222 @@ class EyeTracker():
         self.right_pupil_radius = None
 
         self.looking_direction = None
+        self.stage_times = {}
+
+        self.threshold = threshold
+        self.pupil_engine = pupil_engine
 
-    def update(self, frame):
+        self.gaze_filter = gaze_filter
+        self.detect_every = detect_every
+        self.min_confidence = min_confidence
+        self.frame_count = 0
+        self.analyzed = False
+
+        self.history = history
+
+        self.face_tracking = face_tracking
+        self.redetect_interval = redetect_interval
+        self.tracking_padding = tracking_padding
+        self.max_face_backoff = max_face_backoff
+        self.face_detected = False
+        self.frames_since_detection = 0
+        self.face_missed_frames = 0
+        self.face_backoff = 1
+
+        self.face_scale = face_scale
+        self.eye_scale = eye_scale
+
+    def update(self, frame, frame_gray=None):
         self.frame = frame
-        self._analyze()
+        self.frame_count += 1
+
+        if self.gaze_filter is None:
+            self.analyzed = True
+            self._analyze(frame_gray)
+        # run the whole pipeline only every detect_every frames or when the prediction is not reliable
+        elif self.frame_count % self.detect_every == 0 or self.gaze_filter.confidence() < self.min_confidence:
+            self.analyzed = True
+            self._analyze(frame_gray)
+            self.gaze_filter.step(self._pupil_position())
+            self.looking_direction = self.gaze_filter.direction()
+        else:
+            self.analyzed = False
+            self.stage_times = {}
+            self._clear_detections()
+            self.gaze_filter.step()
+            self.looking_direction = self.gaze_filter.direction()
+
+        # once per frame, result can be called any number of times
+        if self.history is not None:
+            self.history.append(self.result())
+
+    def update_batch(self, frames, workers=1, chunk_size=64):
+        """
+        Analyze recorded frames and return a RESULT_DTYPE array with a record for each frame.
+        Frames is an N x H x W x 3 array or an iterable of chunks (see _batches). The gray conversion of an array chunk
+        is a single call on all its frames, the frames of a list chunk (like the ones of headless.run_batch) are converted
+        one by one, since stacking them would copy every frame. With more than one worker the chunks are analyzed in parallel
+        threads, OpenCV releases the GIL, each chunk by a new tracker with the same options, so the face tracking starts
+        again at every chunk. At most 2 chunks per worker are read ahead of the analysis
+        """
+        if workers <= 1:
+            results = [self._update_chunk(chunk) for chunk in _batches(frames, chunk_size)]
+        else:
+            results = []
+            pending = deque()
+            # the current settings, they may have changed since the constructor (calibration, quality level)
+            options = self._worker_options()
+            with ThreadPoolExecutor(workers) as executor:
+                for chunk in _batches(frames, chunk_size):
+                    # the frames of a chunk stay in memory until it is analyzed, so only a few are submitted at once
+                    if len(pending) == 2 * workers:
+                        results.append(pending.popleft().result())
+                    pending.append(executor.submit(self._analyze_chunk, chunk, options))
+                while pending:
+                    results.append(pending.popleft().result())
+            offset = self.frame_count
+            for records in results:
+                records['frame'] += offset
+                offset += len(records)
+                # the workers have no history, their results are appended here in frame order
+                if self.history is not None:
+                    for record in records:
+                        self.history.append(FrameResult.from_record(record))
+            self.frame_count = offset
+
+        if len(results) == 0:
+            return np.zeros(0, RESULT_DTYPE)
+        return np.concatenate(results)
+
+    def _update_chunk(self, chunk):
+        records = np.zeros(len(chunk), RESULT_DTYPE)
+        if isinstance(chunk, np.ndarray):
+            n, height, width = chunk.shape[:3]
+            # one conversion for the whole chunk, seen as a single tall image
+            chunk = np.ascontiguousarray(chunk)
+            gray = cv2.cvtColor(chunk.reshape(n * height, width, 3), cv2.COLOR_BGR2GRAY).reshape(n, height, width)
+        else:
+            # frames of different buffers are not stacked, copying them costs more than the conversion
+            gray = [None] * len(chunk)
+        for i in range(len(chunk)):
+            self.update(chunk[i], gray[i])
+            self.result().to_record(records[i])
+        return records
+
+    def _worker_options(self):
+        """
+        Constructor options of a tracker with the current settings of this one, for the parallel batch workers
+        """
+        return dict(face_detector=self.face_detector, eye_detector=self.eye_detector, threshold=self.threshold,
+                    face_tracking=self.face_tracking, redetect_interval=self.redetect_interval,
+                    tracking_padding=self.tracking_padding, max_face_backoff=self.max_face_backoff,
+                    face_scale=self.face_scale, eye_scale=self.eye_scale, pupil_engine=self.pupil_engine,
+                    detect_every=self.detect_every, min_confidence=self.min_confidence)
 
+    def _analyze_chunk(self, chunk, options):
+        eye_tracker = EyeTracker(gaze_filter=copy.deepcopy(self.gaze_filter), **options)
+        return eye_tracker._update_chunk(chunk)
 
-    def _analyze(self):
-        self.frame_gray = cv2.cvtColor(self.frame, cv2.COLOR_BGR2GRAY)
+    def _clear_detections(self):
+        """
+        Forget the features of the previous frame on a predicted frame, nothing was detected on it.
+        The face box is kept, it is the tracking state of the next analysis
+        """
+        self.frame_gray = None
+        self.face_detected = False
+        self.left_eye_detected = False
+        self.right_eye_detected = False
+        self.left_eye_bb = None
+        self.right_eye_bb = None
+        self.left_eye_frame = None
+        self.right_eye_frame = None
+        self.left_pupil_detected = False
+        self.right_pupil_detected = False
+        self.left_pupil = None
+        self.right_pupil = None
+        self.left_pupil_radius = None
+        self.right_pupil_radius = None
+
+    def _pupil_position(self):
+        """
+        Mean horizontal position of the detected pupils normalized w.r.t. the eye width, None without pupils.
+        Like _extract_looking_direction it only needs the eye boxes, so it also works on replayed records
+        """
+        positions = []
+        if self.left_eye_detected and self.left_pupil:
+            positions.append(self.left_pupil[0] / self.left_eye_bb[2])
+        if self.right_eye_detected and self.right_pupil:
+            positions.append(self.right_pupil[0] / self.right_eye_bb[2])
+        if len(positions) == 0:
+            return None
+        return sum(positions) / len(positions)
+
+
+    def _analyze(self, frame_gray=None):
+        # time of each stage of the analysis in seconds
+        self.stage_times = {}
+        t0 = time.perf_counter()
+
+        # the batch API converts the whole batch at once
+        if frame_gray is None:
+            frame_gray = cv2.cvtColor(self.frame, cv2.COLOR_BGR2GRAY)
+        self.frame_gray = frame_gray
+        t1 = time.perf_counter()
+        self.stage_times["gray"] = t1 - t0
 
         self._extract_face()
+        t0, t1 = t1, time.perf_counter()
+        self.stage_times["face"] = t1 - t0
+
         self._extract_eyes()
+        t0, t1 = t1, time.perf_counter()
+        self.stage_times["eyes"] = t1 - t0
+
         if self.left_eye_detected:
             self._extract_pupil("left")
+            t0, t1 = t1, time.perf_counter()
+            self.stage_times["left_pupil"] = t1 - t0
 
         if self.right_eye_detected:
             self._extract_pupil("right")
+            t0, t1 = t1, time.perf_counter()
+            self.stage_times["right_pupil"] = t1 - t0
 
         self._extract_looking_direction()
+        t0, t1 = t1, time.perf_counter()
+        self.stage_times["direction"] = t1 - t0
 
 
     def left_eye(self):
         if self.left_eye_detected:
-            return Eye(self.left_eye_frame.copy(), "left", self.left_pupil, self.left_pupil_radius)
+            return Eye(self.left_eye_frame, "left", self.left_pupil, self.left_pupil_radius)
         return None
 
     def right_eye(self):
         if self.right_eye_detected:
-            return Eye(self.right_eye_frame.copy(), "right", self.right_pupil, self.right_pupil_radius)
+            return Eye(self.right_eye_frame, "right", self.right_pupil, self.right_pupil_radius)
         return None
 
+    def result(self):
+        """
+        Compact result of the last frame, with a reference to the frame and not a copy.
+        It has no side effects, the history is filled by update
+        """
+        return FrameResult(
+            self.frame_count,
+            # the face box of a predicted frame is the one of the last analysis
+            _ints(self.face_bb) if self.analyzed else None,
+            _ints(self.left_eye_bb),
+            _ints(self.right_eye_bb),
+            _ints(self.left_pupil) if self.left_eye_detected else None,
+            _ints(self.right_pupil) if self.right_eye_detected else None,
+            self.left_pupil_radius if self.left_eye_detected else None,
+            self.right_pupil_radius if self.right_eye_detected else None,
+            self.looking_direction,
+            self.analyzed,
+            self.frame,
+        )
+
 
     def get_looking_direction(self):
         return self.looking_direction
@@ -108,8 +392,9 @@ class EyeTracker():
         frame = self.frame.copy()
 
         # draw the face bounding box
-        x, y, w, h = self.face_bb
-        cv2.rectangle(frame, (x,y), (x+w,y+h), (255,255,0), 2)
+        if self.face_bb and self.analyzed:
+            x, y, w, h = self.face_bb
+            cv2.rectangle(frame, (x,y), (x+w,y+h), (255,255,0), 2)
 
         if self.left_eye_bb:
 
@@ -148,71 +433,138 @@ class EyeTracker():
     def _extract_face(self):
 
         """
-        Extract the box of the face ROI image as opencv format (x, y, w, h) from the current frame
+        Extract the box of the face ROI image as opencv format (x, y, w, h) from the current frame.
+        With face tracking enabled the face is searched only in a padded window around the previous one,
+        and the whole frame is scanned every redetect_interval frames or when the face is lost
         """
-        frame_gray = cv2.GaussianBlur(self.frame_gray, (7, 7), 0)
+        image_height, image_width = self.frame_gray.shape[:2]
+
+        if not self.face_tracking:
+            best_face = self._detect_face((0, 0, image_width, image_height))
+            self.face_detected = best_face is not None
+            if best_face is None:
+                # if no face is detected return all image as face ROI
+                best_face = (0, 0, image_width, image_height)
+            self.face_bb = best_face
+            return
+
+        best_face = None
+
+        # search around the previous face
+        if self.face_bb is not None and self.frames_since_detection < self.redetect_interval:
+            x, y, w, h = self.face_bb
+            pad_x = int(w * self.tracking_padding)
+            pad_y = int(h * self.tracking_padding)
+            x0, y0 = max(x - pad_x, 0), max(y - pad_y, 0)
+            x1, y1 = min(x + w + pad_x, image_width), min(y + h + pad_y, image_height)
+            min_size = int(min(w, h) * 0.6)
+            best_face = self._detect_face((x0, y0, x1 - x0, y1 - y0), (min_size, min_size))
+            self.frames_since_detection += 1
+
+        # full frame detection when the face is lost or needs refreshing,
+        # backing off exponentially while nobody is in front of the camera
+        if best_face is None:
+            if self.face_missed_frames % self.face_backoff == 0:
+                best_face = self._detect_face((0, 0, image_width, image_height))
+                self.frames_since_detection = 0
+                if best_face is None:
+                    self.face_backoff = min(self.face_backoff * 2, self.max_face_backoff)
+
+        if best_face is None:
+            self.face_missed_frames += 1
+        else:
+            self.face_missed_frames = 0
+            self.face_backoff = 1
+
+        self.face_detected = best_face is not None
+        self.face_bb = best_face
+
+    def _detect_face(self, window, min_size=None):
+
+        """
+        Run the face detector inside a window (x, y, w, h) of the current frame
+        and return the biggest face found in frame coordinates or None
+        """
+        x, y, w, h = window
+        scale = self.face_scale
+        frame_gray = _downscale(self.frame_gray[y:y+h, x:x+w], scale)
+        frame_gray = cv2.GaussianBlur(frame_gray, _blur_kernel(scale), 0)
 #        frame_gray = cv2.medianBlur(frame_gray, 7)
 
-#        faces = self.face_cascade.detectMultiScale(frame_gray) 
-        faces = self.face_cascade.detectMultiScale(frame_gray, 1.3, 5) 
+        if min_size:
+            min_size = (int(min_size[0] * scale), int(min_size[1] * scale))
+        faces = self.face_detector.detect(frame_gray, min_size)
+
+        if len(faces) == 0:
+            return None
 
         # detect the best face on the image based on ROI size
-        if len(faces) > 1:
-            temp = (0, 0, 0, 0)
-            for f in faces:
-                if f[2]*f[3] > temp[2] * temp[3]:
-                    temp = f
-            best_face = (temp[0], temp[1], temp[2], temp[3])
-        elif len(faces) == 1:
-            face = faces[0]
-            best_face = (face[0], face[1], face[2], face[3])
-        else:
-            # if no face is detected return all image as face ROI
-            image_height = self.frame_gray.shape[0]
-            image_width = self.frame_gray.shape[1]
-            best_face = (0, 0, image_width, image_height)
+        fx, fy, fw, fh = max(faces, key=lambda f: f[2] * f[3])
 
-        self.face_bb = best_face
+        # map the face back to full resolution frame coordinates
+        return (x + int(fx / scale), y + int(fy / scale), int(fw / scale), int(fh / scale))
 
     def _extract_eyes(self):
 
         """
-        Extract the box of the eyes ROI image as opencv format (x, y, w, h) from the current frame
+        Extract the box of the eyes ROI image as opencv format (x, y, w, h) from the current frame.
+        Each eye is searched in its half of the upper face band, with sizes bounded by the face width
         """
         self.left_eye_detected = False
         self.right_eye_detected = False
         self.left_eye_bb = None
         self.right_eye_bb = None
+        self.left_pupil_detected = False
+        self.right_pupil_detected = False
+
+        # without a face there is nothing to scan for eyes
+        if self.face_bb is None:
+            return
 
         x, y, w, h = self.face_bb
 
-        face_frame_gray = self.frame_gray[y:y+h, x:x+w] 
-        face_frame_gray = cv2.GaussianBlur(face_frame_gray, (7, 7), 0)
+        # the eyes lie in a band of the upper face and their size is a fraction of the face width
+        band_top, band_bottom = int(EYE_BAND[0] * h), int(EYE_BAND[1] * h)
+        scale = self.eye_scale
+        face_frame_gray = _downscale(self.frame_gray[y+band_top:y+band_bottom, x:x+w], scale)
+        face_frame_gray = cv2.GaussianBlur(face_frame_gray, _blur_kernel(scale), 0)
 #        face_frame_gray = cv2.medianBlur(face_frame_gray, 7)
 
-#        eyes = self.eye_cascade.detectMultiScale(face_frame_gray) 
-        eyes = self.eye_cascade.detectMultiScale(face_frame_gray, 1.3, 5) 
-
-        for (ex, ey, ew, eh) in eyes:
-            # do not consider false eyes detected at the bottom of the face
-            if ey > 0.5 * h:
+        min_size = max(int(EYE_SIZE[0] * w * scale), 1)
+        max_size = max(int(EYE_SIZE[1] * w * scale), min_size)
+        band_width = face_frame_gray.shape[1]
+        half = band_width / 2
+
+        # each half of the face is searched on its own, widened so that an eye across the middle still fits
+        margin = max_size // 2
+        windows = (("left", max(int(half) - margin, 0), band_width), ("right", 0, min(int(half) + margin, band_width)))
+        for position, x0, x1 in windows:
+            eyes = self.eye_detector.detect(face_frame_gray[:, x0:x1], (min_size, min_size), (max_size, max_size))
+
+            # keep only the eyes centered in this half, the biggest one if there are more,
+            # then the highest and the most external one
+            candidates = [(ex + x0, ey, ew, eh) for (ex, ey, ew, eh) in eyes if (ex + x0 + ew / 2 > half) == (position == "left")]
+            if len(candidates) == 0:
                 continue
+            if position == "left":
+                ex, ey, ew, eh = min(candidates, key=lambda e: (-e[2] * e[3], e[1], -e[0]))
+            else:
+                ex, ey, ew, eh = min(candidates, key=lambda e: (-e[2] * e[3], e[1], e[0]))
 
-            remove_eyebrows = np.array([0, int(0.25*eh), int(0), int(-0.25*eh)])
-            eye_center = ex + ew / 2
-            if eye_center > w * 0.5:
-                self.left_eye_detected = True
-                left_bb = np.array([ex, ey, ew, eh])
-                left_bb += remove_eyebrows
-                self.left_eye_bb = (x + left_bb[0], y + left_bb[1], left_bb[2], left_bb[3])
-                self.left_eye_frame = self.frame[self.left_eye_bb[1]:self.left_eye_bb[1]+self.left_eye_bb[3], self.left_eye_bb[0]:self.left_eye_bb[0]+self.left_eye_bb[2]]
+            # map the eye back to full resolution face coordinates
+            ex, ey, ew, eh = int(ex / scale), int(ey / scale) + band_top, int(ew / scale), int(eh / scale)
 
+            remove_eyebrows = (0, int(0.25*eh), 0, int(-0.25*eh))
+            eye_bb = (x + ex + remove_eyebrows[0], y + ey + remove_eyebrows[1], ew + remove_eyebrows[2], eh + remove_eyebrows[3])
+            eye_frame = self.frame[eye_bb[1]:eye_bb[1]+eye_bb[3], eye_bb[0]:eye_bb[0]+eye_bb[2]]
+            if position == "left":
+                self.left_eye_detected = True
+                self.left_eye_bb = eye_bb
+                self.left_eye_frame = eye_frame
             else:
                 self.right_eye_detected = True
-                right_bb = np.array([ex, ey, ew, eh])
-                right_bb += remove_eyebrows
-                self.right_eye_bb = (x + right_bb[0], y + right_bb[1], right_bb[2], right_bb[3])
-                self.right_eye_frame = self.frame[self.right_eye_bb[1]:self.right_eye_bb[1]+self.right_eye_bb[3], self.right_eye_bb[0]:self.right_eye_bb[0]+self.right_eye_bb[2]]
+                self.right_eye_bb = eye_bb
+                self.right_eye_frame = eye_frame
 
 
     def _extract_pupil(self, position):
@@ -222,11 +574,6 @@ class EyeTracker():
         w.r.t the eye frame and the pupil radius in pixels 
         """
 
-        self.left_pupil_detected = False
-        self.right_pupil_detected = False
-        pupil_center = None
-        pupil_radius = None
-
         if position == "left":
             eye_frame_gray = self.frame_gray[self.left_eye_bb[1]:self.left_eye_bb[1]+self.left_eye_bb[3], self.left_eye_bb[0]:self.left_eye_bb[0]+self.left_eye_bb[2]]
 
@@ -245,21 +592,39 @@ class EyeTracker():
 ##        if position == "left":
 ##            cv2.imwrite("images/01_eye_frame_equalized.png", eye_frame_gray)
 
-#        threshold = 25
-        threshold = cv2.getTrackbarPos('threshold', 'frame')
+        eye_frame_th = binarize_eye(eye_frame_gray, self.threshold)
 
-        _, eye_frame_th = cv2.threshold(eye_frame_gray, threshold, 255, cv2.THRESH_BINARY)
+        if self.pupil_engine == "components":
+            pupil_center, pupil_radius = self._pupil_from_components(eye_frame_th)
+        else:
+            pupil_center, pupil_radius = self._pupil_from_contours(eye_frame_th)
 
-##        if position == "left":
-##            cv2.imwrite("images/02_eye_frame_threshold.png", eye_frame_th)
+        # FOR BLOB DETECTION VERSION
+#        keypoints = self.blob_detector.detect(eye_frame_th)
+#        if len(keypoints) > 0:
+#            pupil_center = (int(keypoints[0].pt[0]), int(keypoints[0].pt[1]))
+#            pupil_radius = int(keypoints[0].size / 2)
 
-        eye_frame_th = cv2.erode(eye_frame_th, None, iterations=2)
-        eye_frame_th = cv2.dilate(eye_frame_th, None, iterations=4)
+        if position == "left":
+            if pupil_center != None and pupil_radius != None:
+                self.left_pupil_detected = True
+            self.left_pupil = pupil_center
+            self.left_pupil_radius = pupil_radius
 
-        eye_frame_th = cv2.medianBlur(eye_frame_th, 7)
+        if position == "right":
+            if pupil_center != None and pupil_radius != None:
+                self.right_pupil_detected = True
+            self.right_pupil = pupil_center
+            self.right_pupil_radius = pupil_radius
 
-##        if position == "left":
-##            cv2.imwrite("images/03_eye_frame_medianBlur.png", eye_frame_th)
+
+    def _pupil_from_contours(self, eye_frame_th):
+
+        """
+        Pupil center and radius from the smallest contour of the binarized eye frame
+        """
+        pupil_center = None
+        pupil_radius = None
 
         contours, _ = cv2.findContours(eye_frame_th, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
         contours = sorted(contours, key=lambda x: cv2.contourArea(x))
@@ -284,24 +649,32 @@ class EyeTracker():
                 pupil_center = (int(m['m10'] / m['m00']), int(m['m01'] / m['m00']))
                 break
 
-        # FOR BLOB DETECTION VERSION
-#        keypoints = self.blob_detector.detect(eye_frame_th)
-#        if len(keypoints) > 0:
-#            pupil_center = (int(keypoints[0].pt[0]), int(keypoints[0].pt[1]))
-#            pupil_radius = int(keypoints[0].size / 2)
-
-        if position == "left":
-            if pupil_center != None and pupil_radius != None:
-                self.left_pupil_detected = True
-            self.left_pupil = pupil_center
-            self.left_pupil_radius = pupil_radius
+        return pupil_center, pupil_radius
 
-        if position == "right":
-            if pupil_center != None and pupil_radius != None:
-                self.right_pupil_detected = True
-            self.right_pupil = pupil_center
-            self.right_pupil_radius = pupil_radius
+    def _pupil_from_components(self, eye_frame_th):
 
+        """
+        Pupil center and radius from the dark connected components of the binarized eye frame,
+        chosen from the component statistics without any python loop.
+        Like in calibration.pupil_score, the components touching the eye borders (eyelids, eyebrows, shadows)
+        and the ones too big or not round enough are discarded, the pupil is the biggest of the others
+        """
+        height, width = eye_frame_th.shape
+        _, _, stats, centroids = cv2.connectedComponentsWithStats(cv2.bitwise_not(eye_frame_th), connectivity=8, ltype=cv2.CV_16U)
+
+        # label 0 is the bright background
+        x, y, w, h, areas = stats[1:].T
+        inside = (x > 0) & (y > 0) & (x + w < width) & (y + h < height)
+        # an ellipse fills pi/4 of its bounding box, a round one has the same width and height
+        roundness = np.minimum(areas / (math.pi / 4 * w * h), 1.0) * np.minimum(w, h) / np.maximum(w, h)
+        # the eyelids often cover the top and the bottom of the iris, so a wide blob still counts as round
+        candidates = inside & (areas >= 10) & (areas <= 0.25 * width * height) & (roundness >= 0.25)
+        if not candidates.any():
+            return None, None
+
+        best = np.where(candidates, areas, 0).argmax()
+        cx, cy = centroids[best + 1]
+        return (int(cx), int(cy)), int(round(math.sqrt(areas[best] / math.pi)))
 
     def _extract_looking_direction(self):
         """
@@ -312,8 +685,9 @@ class EyeTracker():
         directionR = None
         directionL = None
 
+        # the eye width comes from the bounding box, so that recorded features can be replayed without frames
         if self.left_eye_detected and self.left_pupil:
-            w = self.left_eye_frame.shape[1]
+            w = self.left_eye_bb[2]
             if self.left_pupil[0] < 0.45 * w:
                 directionL = "right"
             if self.left_pupil[0] > 0.55 * w:
@@ -321,7 +695,7 @@ class EyeTracker():
             direction = directionL
 
         if self.right_eye_detected and self.right_pupil:
-            w = self.right_eye_frame.shape[1]
+            w = self.right_eye_bb[2]
             if self.right_pupil[0] < 0.45 * w:
                 directionR = "right"
             if self.right_pupil[0] > 0.55 * w:
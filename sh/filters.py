@@ -0,0 +1,96 @@
+import math
+
+
+class AlphaBetaFilter:
+    """
+    Alpha-beta filter of a scalar that moves with an almost constant velocity, with time measured in frames
+    Attributes:
+        alpha: correction weight of the position
+        beta: correction weight of the velocity
+        x: filtered position, None before the first measurement
+        v: filtered velocity in units per frame
+        frames_since_measurement: number of predictions since the last measurement
+        residual: running average of the absolute difference between measurements and predictions
+
+    Methods:
+        predict: advance the filter of one frame without measurement
+        update: correct the prediction with a measurement
+        confidence: confidence of the current estimate between 0 and 1
+    """
+    def __init__(self, alpha=0.5, beta=0.1, decay=10, residual_scale=0.1):
+        self.alpha = alpha
+        self.beta = beta
+        self.decay = decay
+        self.residual_scale = residual_scale
+        self.reset()
+
+    def reset(self):
+        self.x = None
+        self.v = 0.0
+        self.frames_since_measurement = 0
+        self.residual = 0.0
+
+    def predict(self):
+        if self.x is not None:
+            self.x += self.v
+            self.frames_since_measurement += 1
+        return self.x
+
+    def update(self, z):
+        if self.x is None:
+            self.x = z
+            self.v = 0.0
+        else:
+            # the prediction spans all the frames without measurement
+            dt = max(self.frames_since_measurement, 1)
+            r = z - self.x
+            self.x += self.alpha * r
+            self.v += self.beta * r / dt
+            self.residual = 0.8 * self.residual + 0.2 * abs(r)
+        self.frames_since_measurement = 0
+        return self.x
+
+    def confidence(self):
+        if self.x is None:
+            return 0.0
+        age = math.exp(-self.frames_since_measurement / self.decay)
+        noise = 1.0 / (1.0 + (self.residual / self.residual_scale) ** 2)
+        return age * noise
+
+
+class GazeFilter:
+    """
+    Temporal filter of the horizontal pupil position, normalized w.r.t. the eye width (0 left border, 1 right border)
+    Attributes:
+        position: AlphaBetaFilter of the normalized pupil position
+        max_missing: number of frames without pupil after which the estimate is dropped
+
+    Methods:
+        step: advance of one frame, with the measured position or None
+        direction: looking direction of the filtered position
+    """
+    def __init__(self, alpha=0.5, beta=0.1, max_missing=15):
+        self.position = AlphaBetaFilter(alpha, beta)
+        self.max_missing = max_missing
+
+    def step(self, measurement=None):
+        self.position.predict()
+        if measurement is not None:
+            self.position.update(measurement)
+        elif self.position.frames_since_measurement > self.max_missing:
+            self.position.reset()
+        return self.position.x
+
+    def confidence(self):
+        return self.position.confidence()
+
+    def direction(self, low=0.45, high=0.55):
+        x = self.position.x
+        if x is None:
+            return None
+        # the camera mirrors the user
+        if x < low:
+            return "right"
+        if x > high:
+            return "left"
+        return None
@@ -0,0 +1,126 @@
+import os
+import cv2
+
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff')
+
+
+class FrameSource:
+    """
+    Base class for a source of BGR frames
+    Attributes:
+        frame_index: number of frames read so far
+
+    Methods:
+        read: return a tuple (ok, frame) like cv2.VideoCapture.read, ok is False when the source is exhausted
+        release: free the underlying resources
+    """
+    def __init__(self):
+        self.frame_index = 0
+
+    def read(self):
+        ok, frame = self._read()
+        if ok:
+            self.frame_index += 1
+        return ok, frame
+
+    def _read(self):
+        raise NotImplementedError
+
+    def release(self):
+        pass
+
+    def __iter__(self):
+        while True:
+            ok, frame = self.read()
+            if not ok:
+                return
+            yield frame
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+class CameraSource(FrameSource):
+    """
+    Live frames from a camera device
+    """
+    def __init__(self, device=0, width=None, height=None):
+        super().__init__()
+        self.capture = cv2.VideoCapture(device)
+        if width:
+            self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        if height:
+            self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+
+    def _read(self):
+        return self.capture.read()
+
+    def release(self):
+        self.capture.release()
+
+
+class VideoFileSource(FrameSource):
+    """
+    Frames replayed from a recorded video file
+    """
+    def __init__(self, path):
+        super().__init__()
+        if not os.path.isfile(path):
+            raise FileNotFoundError(path)
+        self.path = path
+        self.capture = cv2.VideoCapture(path)
+
+    def _read(self):
+        return self.capture.read()
+
+    def release(self):
+        self.capture.release()
+
+
+class ImageSequenceSource(FrameSource):
+    """
+    Frames replayed from the images of a directory, in file name order
+    """
+    def __init__(self, directory):
+        super().__init__()
+        self.paths = sorted(os.path.join(directory, f) for f in os.listdir(directory) if f.lower().endswith(IMAGE_EXTENSIONS))
+        self.position = 0
+
+    def _read(self):
+        while self.position < len(self.paths):
+            frame = cv2.imread(self.paths[self.position], cv2.IMREAD_COLOR)
+            self.position += 1
+            if frame is not None:
+                return True, frame
+        return False, None
+
+
+class GeneratorSource(FrameSource):
+    """
+    Frames taken from any in-memory iterable (list, generator, stack of frames)
+    """
+    def __init__(self, frames):
+        super().__init__()
+        self.frames = iter(frames)
+
+    def _read(self):
+        frame = next(self.frames, None)
+        if frame is None:
+            return False, None
+        return True, frame
+
+
+def open_source(spec, width=None, height=None):
+    """
+    Build a frame source from a command line specification:
+    a camera index (e.g. "0"), a directory of images or a video file
+    """
+    if isinstance(spec, int) or spec.isdigit():
+        return CameraSource(int(spec), width, height)
+    if os.path.isdir(spec):
+        return ImageSequenceSource(spec)
+    return VideoFileSource(spec)
@@ -0,0 +1,125 @@
+import sys
+import json
+import time
+import argparse
+import itertools
+
+# start of the process before the heavy imports, for the startup time report
+STARTED = time.perf_counter()
+
+from eye_tracker import EyeTracker
+from model import FrameResult
+from frame_source import open_source
+from calibration import ThresholdCalibrator
+from filters import GazeFilter
+from detectors import FACE_DETECTORS
+
+
+def frame_result(eye_tracker, index, elapsed):
+    """
+    Collect the features extracted by the eye tracker on the last frame in a JSON serializable dictionary
+    """
+    result = eye_tracker.result().to_dict()
+    del result["frame_index"]
+    result["frame"] = index
+    result["time_ms"] = round(elapsed * 1000, 3)
+    return result
+
+
+def run(source, eye_tracker=None, max_frames=None, calibrator=None):
+    """
+    Stream the frames of a source through the eye tracker as fast as possible,
+    without any window, and yield the per-frame results.
+    With a calibrator the pupil threshold is calibrated on the first frames
+    """
+    if eye_tracker is None:
+        eye_tracker = EyeTracker()
+
+    for index, frame in enumerate(source):
+        if max_frames is not None and index >= max_frames:
+            break
+        start = time.perf_counter()
+        eye_tracker.update(frame)
+        end = time.perf_counter()
+        if calibrator is not None:
+            calibrator.update(eye_tracker)
+        yield frame_result(eye_tracker, index, end - start)
+
+
+def run_batch(source, eye_tracker=None, max_frames=None, workers=2, chunk_size=64):
+    """
+    Like run, but the frames are analyzed in chunks by parallel workers with EyeTracker.update_batch.
+    The face tracking restarts at every chunk and the results have no per-frame time
+    """
+    if eye_tracker is None:
+        eye_tracker = EyeTracker()
+
+    frames = itertools.islice(source, max_frames)
+    index = 0
+    while True:
+        # read only the frames analyzed at once, recordings can be hours long
+        block = list(itertools.islice(frames, workers * chunk_size))
+        if len(block) == 0:
+            break
+        for record in eye_tracker.update_batch(block, workers, chunk_size):
+            result = FrameResult.from_record(record).to_dict()
+            del result["frame_index"]
+            result["frame"] = index
+            result["time_ms"] = None
+            index += 1
+            yield result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the eye tracker without camera or display")
+    parser.add_argument("source", help="camera index, video file or directory of images")
+    parser.add_argument("-o", "--output", default="-", help="where to write the per-frame results as JSON lines (default stdout)")
+    parser.add_argument("-n", "--max-frames", type=int, default=None, help="stop after this number of frames")
+    parser.add_argument("-t", "--threshold", type=int, default=25, help="pupil binarization threshold")
+    parser.add_argument("-k", "--detect-every", type=int, default=None, help="filter the pupil positions and run the whole pipeline only every k frames")
+    parser.add_argument("-c", "--calibrate", action="store_true", help="calibrate the pupil threshold on the first frames")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="analyze the frames in chunks with this number of parallel workers")
+    parser.add_argument("-f", "--face-detector", default="haar", choices=list(FACE_DETECTORS), help="face detector backend")
+    parser.add_argument("--face-scale", type=float, default=0.5, help="resolution scale used for face detection")
+    parser.add_argument("--eye-scale", type=float, default=0.75, help="resolution scale used for eye detection")
+    args = parser.parse_args()
+    if args.workers and args.calibrate:
+        parser.error("--calibrate needs the frames in order, it can not be used with --workers")
+
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+
+    frames = 0
+    busy = 0.0
+    first_frame = None
+    start = time.perf_counter()
+    with open_source(args.source) as source:
+        gaze_filter = GazeFilter() if args.detect_every else None
+        eye_tracker = EyeTracker(threshold=args.threshold, face_scale=args.face_scale, eye_scale=args.eye_scale, face_detector=args.face_detector,
+                                 gaze_filter=gaze_filter, detect_every=args.detect_every or 1)
+        calibrator = ThresholdCalibrator() if args.calibrate else None
+        if args.workers:
+            results = run_batch(source, eye_tracker, args.max_frames, args.workers)
+        else:
+            results = run(source, eye_tracker, args.max_frames, calibrator)
+        for result in results:
+            if first_frame is None:
+                first_frame = time.perf_counter() - STARTED
+            out.write(json.dumps(result) + "\n")
+            frames += 1
+            busy += result["time_ms"] or 0
+    total = time.perf_counter() - start
+
+    if out is not sys.stdout:
+        out.close()
+
+    if frames:
+        print("first frame analyzed {:.3f} s after the start".format(first_frame), file=sys.stderr)
+        if args.workers:
+            print("{} frames in {:.3f} s: {:.1f} fps overall".format(frames, total, frames / total), file=sys.stderr)
+        else:
+            print("{} frames in {:.3f} s: {:.1f} fps overall, {:.3f} ms per frame in the tracker".format(
+                frames, total, frames / total, busy / frames), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
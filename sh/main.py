@@ -3,26 +3,27 @@ import os
 import argparse
 import time
 import datetime
+
+# start of the process before the heavy imports, for the startup time report
+STARTED = time.perf_counter()
+
 import cv2
 import numpy as np
-from enum import Enum
-from threading import Timer
-import pyautogui
 
 from eye_tracker import EyeTracker
-from screen import Screen
-from quiz import Quiz
-
+from frame_source import CameraSource
+from capture import ThreadedCapture
+from screen import Screen, screen_size
+from quiz import Quiz, min_decision_decay
+from telemetry import Telemetry
+from calibration import ThresholdCalibrator
+from filters import GazeFilter
+from scheduler import Mode, ModeScheduler
+from quality import QualityController
+from recording import SessionRecorder
+from detectors import FACE_DETECTORS
+from preview import Preview
 
-class Mode(Enum):
-    AWAITING = 0
-    READING = 1
-    ANSWERING = 2
-    BEGINNING = 3
-    COMPLETED = 4
-
-RES_SCREEN = pyautogui.size() # RES_SCREEN[0] -> width
-                              # RES_SCREEN[1] -> heigth
 
 SCREEN_WIDTH = 1280
 SCREEN_HEIGHT = 360
@@ -33,143 +34,194 @@ FRAME_HEIGHT = 720
 TIME_READING = 5
 TIME_ANSWERING = 5
 
-mode = Mode.BEGINNING
-
-def timeout_reading():
-    global mode
-    mode = Mode.ANSWERING
-    timer_answering = Timer(TIME_ANSWERING, timeout_answering)
-    timer_answering.start()
-    return
-
-def timeout_answering():
-    global mode
-    mode = Mode.AWAITING
-    return
-
 
 def nothing(val):
     pass
 
 
 def main():
-    global mode
-
-    camera = cv2.VideoCapture(0)
-    camera.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_WIDTH)
-    camera.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_HEIGHT)
-
-    eye_tracker = EyeTracker()
+    parser = argparse.ArgumentParser(description="The Sorting Hat")
+    parser.add_argument("--telemetry", default=None, help="directory where the telemetry is exported (telemetry.jsonl and telemetry.prom)")
+    parser.add_argument("-e", "--early-decision", action="store_true", help="close the answer as soon as the votes settle it instead of waiting the whole answering time")
+    parser.add_argument("--vote-decay", type=float, default=1.0, help="weight of the previous votes at each new vote, lower values favour the recent ones")
+    parser.add_argument("--target-fps", type=float, default=30, help="frame rate the loop tries to keep lowering the quality under load, 0 to always use the best quality")
+    parser.add_argument("--record", default=None, help="directory where the features of every frame of the session are recorded")
+    parser.add_argument("-f", "--face-detector", default="haar", choices=list(FACE_DETECTORS), help="face detector backend")
+    parser.add_argument("--no-preview", action="store_true", help="do not show the camera preview, for production stations")
+    parser.add_argument("--preview-fps", type=float, default=15, help="maximum frame rate of the camera preview")
+    parser.add_argument("-k", "--detect-every", type=int, default=None, help="filter the pupil positions and run the whole pipeline only every k frames")
+    args = parser.parse_args()
+    if args.early_decision and args.vote_decay <= min_decision_decay():
+        parser.error("with --vote-decay {} the votes can never settle an answer, --early-decision needs a decay above {:.3f}".format(
+            args.vote_decay, min_decision_decay()))
+
+    if args.telemetry:
+        os.makedirs(args.telemetry, exist_ok=True)
+        telemetry = Telemetry(jsonl_path=os.path.join(args.telemetry, 'telemetry.jsonl'),
+                              prometheus_path=os.path.join(args.telemetry, 'telemetry.prom'))
+    else:
+        telemetry = Telemetry()
+    telemetry.start()
+    last_mode = None
+    first_frame = None
+
+    # capture in background so that the analysis always gets the newest frame
+    camera = ThreadedCapture(CameraSource(0, FRAME_WIDTH, FRAME_HEIGHT)).start()
+
+    if args.detect_every:
+        eye_tracker = EyeTracker(gaze_filter=GazeFilter(), detect_every=args.detect_every, face_detector=args.face_detector)
+    else:
+        eye_tracker = EyeTracker(face_detector=args.face_detector)
+
+    recorder = None
+    if args.record:
+        os.makedirs(args.record, exist_ok=True)
+        # what replay needs to weigh the votes as this session does
+        options = {"quiz": {"decay": args.vote_decay}, "gaze_filter": None}
+        if eye_tracker.gaze_filter is not None:
+            gaze_filter = eye_tracker.gaze_filter
+            options["gaze_filter"] = {"alpha": gaze_filter.position.alpha, "beta": gaze_filter.position.beta,
+                                      "max_missing": gaze_filter.max_missing}
+        recorder = SessionRecorder(os.path.join(args.record, datetime.datetime.now().strftime("session-%Y%m%d-%H%M%S.rec")),
+                                   options=options)
     screen = Screen(SCREEN_WIDTH, SCREEN_HEIGHT)
 
-    screen.clean()
-    screen.print_title()
-    screen.print_instructions()
+    screen.clean(title=True, instructions=True)
     screen.show()
 
     quiz = None
-    cv2.namedWindow("frame")
-    cv2.createTrackbar('threshold', 'frame', 0, 255, nothing)
-    cv2.setTrackbarPos('threshold', 'frame', 25)
+    quiz_index = -1
+    id_q = None
+    # the quiz modes change only here in the loop, when their time is over or on key presses
+    scheduler = ModeScheduler(TIME_READING, TIME_ANSWERING)
+    # the preview is drawn in background, and the threshold trackbar lives in its window
+    preview = None
+    trackbar_threshold = 25
+    if not args.no_preview:
+        preview = Preview("frame", 1 / 1.5, args.preview_fps).start()
+        cv2.namedWindow("frame")
+        cv2.createTrackbar('threshold', 'frame', 0, 255, nothing)
+        cv2.setTrackbarPos('threshold', 'frame', trackbar_threshold)
+        cv2.moveWindow("frame", int(screen_size()[0] / 2 - FRAME_WIDTH / 3), screen.height + 75)
+
+    # degrade the detection and the preview when the loop can not keep the frame rate
+    quality = QualityController(1 / args.target_fps) if args.target_fps > 0 else None
+
+    # the threshold is calibrated on the first frames and at each new quiz
+    calibrator = ThresholdCalibrator()
 
 ##    os.makedirs("./images", exist_ok=True)
 
     while True:
-        print(mode)
+        mode = scheduler.update()
+        if mode != last_mode:
+            telemetry.record_mode(last_mode, mode)
+            last_mode = mode
 
         _, frame = camera.read() 
 
-        start = time.time()
+        # moving the trackbar overrides the calibrated threshold
+        if preview is not None:
+            threshold = cv2.getTrackbarPos('threshold', 'frame')
+            if threshold != trackbar_threshold:
+                calibrator.set_threshold(threshold)
+                trackbar_threshold = threshold
+
+        if quality is not None:
+            quality.apply(eye_tracker)
+
+        start = time.perf_counter()
         eye_tracker.update(frame)
-        end = time.time()
+        end = time.perf_counter()
 
-        print("TIME: {:.3f} ms".format(end*1000 - start*1000))
+        if first_frame is None:
+            first_frame = time.perf_counter() - STARTED
+            print("STARTUP: first frame analyzed after {:.3f} s".format(first_frame))
 
-        dec_frame = eye_tracker.decorate_frame()
-        dec_frame = cv2.resize(dec_frame,(int(FRAME_WIDTH / 1.5), int(FRAME_HEIGHT / 1.5)))
+        telemetry.record(eye_tracker, camera.frame_index, mode, camera.dropped_frames, end - start,
+                         quality.level if quality is not None else None)
 
-        cv2.namedWindow("frame")
-        cv2.moveWindow("frame", int(RES_SCREEN[0] / 2 - FRAME_WIDTH / 3), screen.height + 75)
-        cv2.imshow('frame', dec_frame)
+        # with the gaze filter the votes weigh as much as the filter is confident
+        weight = eye_tracker.gaze_filter.confidence() if eye_tracker.gaze_filter else 1.0
 
-        screen.clean()
-        screen.print_title()
-        screen.print_instructions()
+        if recorder is not None:
+            recorder.record(eye_tracker, mode, quiz_index if quiz is not None else None, id_q, weight)
 
-        direction = eye_tracker.get_looking_direction()
-        print("DIRECTION: {}".format(direction))
+        calibrator.update(eye_tracker)
+        if preview is not None:
+            if eye_tracker.threshold != trackbar_threshold:
+                trackbar_threshold = eye_tracker.threshold
+                cv2.setTrackbarPos('threshold', 'frame', trackbar_threshold)
 
-        if direction:
-            screen.update_direction(direction)
-            screen.color_answers()
-        else:
-            screen.clean_answers()
+            # the preview draws the same result the quiz uses, off this thread
+            if quality is None or quality.preview_due(camera.frame_index):
+                preview.overlay = quality is None or quality.settings["decorate"]
+                preview.submit(frame, eye_tracker.result())
+            preview.show()
 
-        screen.show()
+        direction = eye_tracker.get_looking_direction()
+
+        # only the regions whose content changed are redrawn
+        if mode == Mode.BEGINNING:
+            screen.draw_header(title=True)
+            screen.draw_panel(direction)
 
         if mode == Mode.READING:
-            screen.clean()
-            screen.print_instructions()
-            screen.print_question(question)
-            screen.show()
+            screen.draw_header(question=question)
+            screen.draw_panel(answers=False)
 
         if mode == Mode.ANSWERING:
-            screen.clean()
-            screen.print_instructions()
-            screen.print_question(question)
-            screen.print_answers()
-
-            direction = eye_tracker.get_looking_direction()
-            print("DIRECTION: {}".format(direction))
-
-            if direction:
-                screen.update_direction(direction)
-                screen.color_answers()
-                if direction == 'left':
-                    quiz.add_answer(id_q, 'yes')
-                if direction == 'right':
-                    quiz.add_answer(id_q, 'no')
-            else:
-                screen.clean_answers()
-            screen.show()
+            screen.draw_header(question=question)
+            screen.draw_panel(direction)
+            if direction == 'left':
+                quiz.add_answer(id_q, 'yes', weight)
+            if direction == 'right':
+                quiz.add_answer(id_q, 'no', weight)
+            if args.early_decision and quiz.is_decided(id_q):
+                scheduler.close_answers()
 
         if mode == Mode.AWAITING:
             answer = quiz.get_answer(id_q)
-            screen.clean()
-            screen.print_instructions()
-            screen.print_question(question)
-            screen.confirm_answer(answer)
-            screen.show()
+            screen.draw_header(question=question)
+            screen.draw_panel(confirmed=answer)
 
         if mode == Mode.COMPLETED:
             result = quiz.compute_result()
-            screen.clean()
-            screen.print_instructions()
-            screen.show_result(result)
+            screen.draw_result(result)
+
+        screen.show()
+
+        if quality is not None:
+            # the cost of the frame is the analysis plus the rendering, not the wait for the camera
+            quality.update(time.perf_counter() - start)
 
         k = cv2.waitKey(1) & 0xff
 
         if k == 1048603 or k == 27: # esc to terminate quiz
             break
         if k == ord('s'): # start quiz
-            quiz = Quiz()
+            calibrator.start()
+            quiz = Quiz(decay=args.vote_decay)
+            quiz_index += 1
             id_q = list(quiz.questions.keys())[0]
             question = quiz.questions.pop(id_q)
-            mode = Mode.READING
-            timer_reading = Timer(TIME_READING, timeout_reading)
-            timer_reading.start()
+            scheduler.read_question()
         if k == ord('n') and mode == Mode.AWAITING: # next question
             # end quiz condition
             if len(quiz.questions.keys()) == 0:
-                mode = Mode.COMPLETED
+                scheduler.complete()
             else:
                 id_q = list(quiz.questions.keys())[0]
                 question = quiz.questions.pop(id_q)
-                mode = Mode.READING
-                timer_reading = Timer(TIME_READING, timeout_reading)
-                timer_reading.start()
+                scheduler.read_question()
 
+    print("FRAMES: {} captured, {} dropped".format(camera.captured_frames, camera.dropped_frames))
     camera.release()
+    if preview is not None:
+        preview.stop()
+    telemetry.stop()
+    if recorder is not None:
+        recorder.close()
     cv2.destroyAllWindows()
     os._exit(0)
 
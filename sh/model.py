@@ -1,13 +1,36 @@
+import numpy as np
+
+
+DIRECTIONS = {None: -1, 'left': 0, 'right': 1}
+
+DIRECTION_NAMES = {code: name for name, code in DIRECTIONS.items()}
+
+# fixed size record of the features extracted from a frame, -1 where a feature is missing
+RESULT_DTYPE = np.dtype([
+    ('frame', 'i8'),
+    ('face_bb', 'i4', 4),
+    ('left_eye_bb', 'i4', 4),
+    ('right_eye_bb', 'i4', 4),
+    ('left_pupil', 'i4', 2),
+    ('right_pupil', 'i4', 2),
+    ('left_pupil_radius', 'i4'),
+    ('right_pupil_radius', 'i4'),
+    ('direction', 'i1'),
+    ('analyzed', 'u1'),
+])
+
+
 class Eye:
 
     """
     Model class for an eye
     Attributes:
-        image: eye ROI of original image
+        frame: eye ROI of original image, a view on the frame until copy is called
         position: string to identify left or right eye
         pupil_center: a tuple (x, y) with the coordinates of the center of the pupil w.r.t the eye ROI image
         pupil_radius: radius of the pupil in pixels
     """
+    __slots__ = ('frame', 'position', 'pupil_center', 'pupil_radius')
 
     def __init__(self, frame, position, pupil_center, pupil_radius):
         self.frame = frame
@@ -15,6 +38,133 @@ class Eye:
         self.pupil_center = pupil_center
         self.pupil_radius = pupil_radius
 
+    def copy(self):
+        """
+        Return an eye that owns a copy of the ROI, safe to keep after the next frame
+        """
+        return Eye(self.frame.copy(), self.position, self.pupil_center, self.pupil_radius)
+
     def __str__(self):
         return "Eye: {}\n\tPupil center: {}\n\tPupil radius: {}\n".format(self.position, self.pupil_center, self.pupil_radius)
 
+
+def _tuple(values):
+    if values[0] < 0:
+        return None
+    return tuple(int(v) for v in values)
+
+
+class FrameResult:
+
+    """
+    Model class for the features extracted from a frame, in full frame coordinates
+    Attributes:
+        frame_index: index of the analyzed frame
+        face_bb: face bounding box (x, y, w, h) or None
+        left_eye_bb, right_eye_bb: eye bounding boxes (x, y, w, h) or None
+        left_pupil, right_pupil: pupil centers (x, y) w.r.t. the eye bounding box or None
+        left_pupil_radius, right_pupil_radius: pupil radius in pixels or None
+        direction: looking direction as string (left or right) or None
+        analyzed: False if the result was predicted instead of analyzed
+        frame: the analyzed frame, referenced and not copied, None for results read back from records
+
+    Methods:
+        left_eye, right_eye: Eye objects with views on the frame
+        to_record, from_record: conversion from and to a RESULT_DTYPE record
+        to_dict: JSON serializable dictionary
+    """
+    __slots__ = ('frame_index', 'face_bb', 'left_eye_bb', 'right_eye_bb', 'left_pupil', 'right_pupil',
+                 'left_pupil_radius', 'right_pupil_radius', 'direction', 'analyzed', 'frame')
+
+    def __init__(self, frame_index=0, face_bb=None, left_eye_bb=None, right_eye_bb=None, left_pupil=None, right_pupil=None,
+                 left_pupil_radius=None, right_pupil_radius=None, direction=None, analyzed=True, frame=None):
+        self.frame_index = frame_index
+        self.face_bb = face_bb
+        self.left_eye_bb = left_eye_bb
+        self.right_eye_bb = right_eye_bb
+        self.left_pupil = left_pupil
+        self.right_pupil = right_pupil
+        self.left_pupil_radius = left_pupil_radius
+        self.right_pupil_radius = right_pupil_radius
+        self.direction = direction
+        self.analyzed = analyzed
+        self.frame = frame
+
+    def _eye(self, bb, position, pupil, radius):
+        if bb is None or self.frame is None:
+            return None
+        x, y, w, h = bb
+        return Eye(self.frame[y:y+h, x:x+w], position, pupil, radius)
+
+    def left_eye(self):
+        return self._eye(self.left_eye_bb, "left", self.left_pupil, self.left_pupil_radius)
+
+    def right_eye(self):
+        return self._eye(self.right_eye_bb, "right", self.right_pupil, self.right_pupil_radius)
+
+    def to_record(self, record=None):
+        """
+        Write the result in a RESULT_DTYPE record, a new one if not given
+        """
+        if record is None:
+            record = np.zeros((), RESULT_DTYPE)
+        record['frame'] = self.frame_index
+        record['face_bb'] = self.face_bb if self.face_bb is not None else -1
+        record['left_eye_bb'] = self.left_eye_bb if self.left_eye_bb is not None else -1
+        record['right_eye_bb'] = self.right_eye_bb if self.right_eye_bb is not None else -1
+        record['left_pupil'] = self.left_pupil if self.left_pupil is not None else -1
+        record['right_pupil'] = self.right_pupil if self.right_pupil is not None else -1
+        record['left_pupil_radius'] = self.left_pupil_radius if self.left_pupil_radius is not None else -1
+        record['right_pupil_radius'] = self.right_pupil_radius if self.right_pupil_radius is not None else -1
+        record['direction'] = DIRECTIONS.get(self.direction, -1)
+        record['analyzed'] = self.analyzed
+        return record
+
+    @classmethod
+    def from_record(cls, record):
+        left_radius = int(record['left_pupil_radius'])
+        right_radius = int(record['right_pupil_radius'])
+        return cls(int(record['frame']), _tuple(record['face_bb']), _tuple(record['left_eye_bb']), _tuple(record['right_eye_bb']),
+                   _tuple(record['left_pupil']), _tuple(record['right_pupil']),
+                   left_radius if left_radius >= 0 else None, right_radius if right_radius >= 0 else None,
+                   DIRECTION_NAMES.get(int(record['direction'])), bool(record['analyzed']))
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__ if name != 'frame'}
+
+
+class ResultHistory:
+
+    """
+    Fixed capacity history of frame results, stored in a preallocated RESULT_DTYPE array
+    Attributes:
+        capacity: maximum number of results kept, the oldest are overwritten
+        count: number of results appended so far
+
+    Methods:
+        append: store a FrameResult
+        records: the stored records from the oldest to the newest
+        last: the last stored result as FrameResult
+    """
+    def __init__(self, capacity=1024):
+        self.capacity = capacity
+        self.count = 0
+        self._records = np.zeros(capacity, RESULT_DTYPE)
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, result):
+        result.to_record(self._records[self.count % self.capacity])
+        self.count += 1
+
+    def records(self):
+        if self.count <= self.capacity:
+            return self._records[:self.count]
+        start = self.count % self.capacity
+        return np.concatenate((self._records[start:], self._records[:start]))
+
+    def last(self):
+        if self.count == 0:
+            return None
+        return FrameResult.from_record(self._records[(self.count - 1) % self.capacity])
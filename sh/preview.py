@@ -0,0 +1,114 @@
+import time
+import threading
+import cv2
+
+
+def draw_overlay(image, result, scale):
+    """
+    Draw the features of a FrameResult on an image that is the frame resized by scale, in place
+    """
+    def point(x, y):
+        return (int(x * scale), int(y * scale))
+
+    # draw the face bounding box
+    if result.face_bb:
+        x, y, w, h = result.face_bb
+        cv2.rectangle(image, point(x, y), point(x + w, y + h), (255,255,0), 1)
+
+    for eye_bb, pupil, radius in ((result.left_eye_bb, result.left_pupil, result.left_pupil_radius),
+                                  (result.right_eye_bb, result.right_pupil, result.right_pupil_radius)):
+        if not eye_bb:
+            continue
+        x, y, w, h = eye_bb
+        if pupil and radius:
+            # draw the pupil center and its border
+            center = point(x + pupil[0], y + pupil[1])
+            cv2.circle(image, center, 1, (0, 0, 255), -1)
+            cv2.circle(image, center, max(int(radius * scale), 1), (0, 255, 0), 1)
+        # draw the eye bounding box
+        cv2.rectangle(image, point(x, y), point(x + w, y + h), (255,0,255), 1)
+    return image
+
+
+class Preview:
+    """
+    Operator preview of the camera frames with the extracted features.
+    The analysis loop only hands over the frame and its FrameResult, a background thread resizes the frame
+    and draws the overlay at most fps times per second, and show displays the last image from the gui thread
+    Attributes:
+        window: name of the preview window
+        scale: size of the preview w.r.t. the frame
+        fps: maximum preview frame rate
+        overlay: False to show the frames without the features
+        rendered: number of preview images drawn
+
+    Methods:
+        start: start the drawing thread
+        submit: hand over the last frame and its result, it never waits
+        show: display the last drawn image, if there is a new one
+        stop: stop the drawing thread
+    """
+    def __init__(self, window="frame", scale=1/1.5, fps=15, overlay=True):
+        self.window = window
+        self.scale = scale
+        self.fps = fps
+        self.overlay = overlay
+        self.rendered = 0
+
+        self._condition = threading.Condition()
+        self._pending = None
+        self._image = None
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="preview", daemon=True)
+            self._thread.start()
+        return self
+
+    def submit(self, frame, result):
+        with self._condition:
+            # only the newest frame matters, an older one not drawn yet is dropped
+            self._pending = (frame, result)
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and self._pending is None:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                frame, result = self._pending
+                self._pending = None
+
+            start = time.perf_counter()
+            height, width = frame.shape[:2]
+            # the overlay is drawn on the small copy, the frame of the analysis is never copied at full size
+            image = cv2.resize(frame, (int(width * self.scale), int(height * self.scale)), interpolation=cv2.INTER_NEAREST)
+            if self.overlay:
+                draw_overlay(image, result, self.scale)
+            with self._condition:
+                self._image = image
+                self.rendered += 1
+
+            # keep the preview at its own frame rate
+            delay = 1 / self.fps - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+
+    def show(self):
+        with self._condition:
+            image, self._image = self._image, None
+        if image is not None:
+            cv2.imshow(self.window, image)
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
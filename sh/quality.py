@@ -0,0 +1,78 @@
+from collections import deque
+
+
+# quality levels from the best to the cheapest
+LEVELS = (
+    {"face_scale": 0.5, "eye_scale": 0.75, "redetect_interval": 10, "preview_every": 1, "decorate": True},
+    {"face_scale": 0.35, "eye_scale": 0.75, "redetect_interval": 10, "preview_every": 1, "decorate": True},
+    {"face_scale": 0.35, "eye_scale": 0.75, "redetect_interval": 30, "preview_every": 2, "decorate": True},
+    {"face_scale": 0.25, "eye_scale": 0.5, "redetect_interval": 60, "preview_every": 4, "decorate": False},
+)
+
+
+class QualityController:
+    """
+    Keeps the cost of the main loop within a frame budget.
+    It tracks the rolling mean of the frame costs and moves to a cheaper quality level when the mean exceeds
+    the target frame time, and back to a better one when there is enough headroom
+    Attributes:
+        target_frame_time: frame budget in seconds
+        levels: settings of each quality level, from the best to the cheapest
+        window: number of frames of the rolling mean
+        upgrade_ratio: the quality improves when the mean cost is below this fraction of the budget
+        level: index of the current quality level
+        settings: settings of the current quality level
+
+    Methods:
+        update: add the cost of the last frame, it may change the level
+        apply: set the detection settings of the current level on an EyeTracker
+        preview_due: True if the preview has to be shown at the given frame
+    """
+    def __init__(self, target_frame_time=1/30, levels=LEVELS, window=30, upgrade_ratio=0.6):
+        self.target_frame_time = target_frame_time
+        self.levels = levels
+        self.window = window
+        self.upgrade_ratio = upgrade_ratio
+        self.level = 0
+        self._costs = deque()
+        self._sum = 0.0
+
+    @property
+    def settings(self):
+        return self.levels[self.level]
+
+    def mean_cost(self):
+        if len(self._costs) == 0:
+            return 0.0
+        return self._sum / len(self._costs)
+
+    def update(self, frame_cost):
+        self._costs.append(frame_cost)
+        self._sum += frame_cost
+        if len(self._costs) > self.window:
+            self._sum -= self._costs.popleft()
+
+        # decide only on a full window, so that a single slow frame does not change the level
+        if len(self._costs) < self.window:
+            return self.level
+
+        mean = self.mean_cost()
+        if mean > self.target_frame_time and self.level < len(self.levels) - 1:
+            self._set_level(self.level + 1)
+        elif mean < self.target_frame_time * self.upgrade_ratio and self.level > 0:
+            self._set_level(self.level - 1)
+        return self.level
+
+    def _set_level(self, level):
+        self.level = level
+        # the costs measured at the previous level do not tell anything about the new one
+        self._costs.clear()
+        self._sum = 0.0
+
+    def apply(self, eye_tracker):
+        eye_tracker.face_scale = self.settings["face_scale"]
+        eye_tracker.eye_scale = self.settings["eye_scale"]
+        eye_tracker.redetect_interval = self.settings["redetect_interval"]
+
+    def preview_due(self, frame_index):
+        return frame_index % self.settings["preview_every"] == 0
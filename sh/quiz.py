@@ -1,18 +1,84 @@
 import numpy as np
 import cv2
+import math
 import random
 
+
+def min_decision_decay(majority=0.7, error=0.001):
+    """
+    Lowest vote decay with which VoteCounter.decided can ever be True: with a decay d < 1 and votes of weight
+    at most 1, the gap between yes and no never reaches 1 / (1 - d), while the sequential test needs a gap of
+    log((1 - error) / error) / log(majority / (1 - majority))
+    """
+    gap = math.log((1 - error) / error) / math.log(majority / (1 - majority))
+    return 1 - 1 / gap
+
+
+class VoteCounter:
+    """
+    Constant memory accumulator of the yes/no votes given to a question, one vote per frame
+    Attributes:
+        yes, no: weighted number of votes for each answer
+        votes: number of votes added
+        decay: weight of the previous votes when a new one is added, 1 to weigh all the votes the same
+        majority: share of the votes expected for the right answer by the sequential test
+        error: accepted probability that the sequential test picks the wrong answer
+        min_votes: number of votes before the sequential test can decide
+
+    Methods:
+        add: add a vote, with an optional weight (e.g. the confidence of the looking direction)
+        answer: the answer with more votes, 'yes' on ties
+        decided: True when the sequential test says the answer can not change anymore
+    """
+    __slots__ = ('yes', 'no', 'votes', 'decay', 'majority', 'error', 'min_votes')
+
+    def __init__(self, decay=1.0, majority=0.7, error=0.001, min_votes=15):
+        self.yes = 0.0
+        self.no = 0.0
+        self.votes = 0
+        self.decay = decay
+        self.majority = majority
+        self.error = error
+        self.min_votes = min_votes
+
+    def add(self, answer, weight=1.0):
+        if self.decay != 1:
+            self.yes *= self.decay
+            self.no *= self.decay
+        if answer == 'yes':
+            self.yes += weight
+        elif answer == 'no':
+            self.no += weight
+        self.votes += 1
+
+    def answer(self):
+        if self.yes >= self.no:
+            return 'yes'
+        return 'no'
+
+    def decided(self):
+        """
+        Sequential probability ratio test of "the user says yes with probability majority"
+        against "the user says no with probability majority", each vote being a Bernoulli sample.
+        With a decay lower than min_decision_decay it is never True
+        """
+        if self.votes < self.min_votes:
+            return False
+        llr = (self.yes - self.no) * math.log(self.majority / (1 - self.majority))
+        return abs(llr) >= math.log((1 - self.error) / self.error)
+
+
 class Quiz:
     """
     Class for quiz data
     Attributes:
         questions: a dictionary contains all questions (id: string)
-        answers: a dictionary contains all the user answers (id: list of answers)
+        answers: a dictionary contains the votes of the user for each question (id: VoteCounter)
         results: a dictionary contains the final computed result of the quiz (string: score)
     """
-    def __init__(self):
+    def __init__(self, decay=1.0, majority=0.7, error=0.001, min_votes=15):
         self.questions = {}
-        self.answers = {id_q: list() for id_q in range(0,13) }
+        self.answers = {id_q: VoteCounter(decay, majority, error, min_votes) for id_q in range(0,13) }
         self.scores = {}
         self.results = None
         self.load_questions()
@@ -66,21 +132,14 @@ class Quiz:
             }
 
 
-    def add_answer(self, id_q, answer):
-        self.answers[id_q] = self.answers.get(id_q, list())
-        self.answers[id_q].append(answer)
+    def add_answer(self, id_q, answer, weight=1.0):
+        self.answers[id_q].add(answer, weight)
 
     def get_answer(self, id_q):
-        answers = self.answers.get(id_q, list())
-        num_yes = answers.count('yes') 
-        num_no = answers.count('no') 
+        return self.answers[id_q].answer()
 
-        if num_yes >= num_no:
-            return 'yes'
-        elif num_yes < num_no:
-            return 'no'
-#        else:
-#            return random.choice(['yes', 'no'])
+    def is_decided(self, id_q):
+        return self.answers[id_q].decided()
 
     def compute_result(self):
         if self.results == None:
@@ -0,0 +1,104 @@
+import os
+import json
+import time
+import numpy as np
+
+from model import RESULT_DTYPE
+
+
+# fixed size record of a frame of a session: the tracker features, the quiz state and the timestamps
+RECORDING_DTYPE = np.dtype(RESULT_DTYPE.descr + [
+    ('mode', 'i1'),
+    ('quiz', 'i2'),
+    ('question', 'i2'),
+    ('weight', 'f4'),
+    ('time', 'f8'),
+    ('elapsed', 'f4'),
+])
+
+
+def read_recording(path):
+    """
+    Map a recording in memory as a read only array of RECORDING_DTYPE records.
+    A partial record at the end, left by an interrupted session, is ignored
+    """
+    count = os.path.getsize(path) // RECORDING_DTYPE.itemsize
+    if count == 0:
+        return np.zeros(0, RECORDING_DTYPE)
+    return np.memmap(path, RECORDING_DTYPE, 'r', shape=(count,))
+
+
+def read_options(path):
+    """
+    Options of the session saved next to a recording by SessionRecorder, empty without the file
+    """
+    options_path = path + '.json'
+    if not os.path.isfile(options_path):
+        return {}
+    with open(options_path) as f:
+        return json.load(f)
+
+
+class SessionRecorder:
+    """
+    Append the features extracted from each frame of a session to a binary file of RECORDING_DTYPE records,
+    without header, that read_recording maps back with np.memmap.
+    The options needed to score the session again (quiz and gaze filter) go to a JSON file next to it, see read_options
+    Attributes:
+        path: file of the recording
+        options: options of the session, saved in path + '.json'
+        buffer_size: number of records written to the file at once
+        count: number of records recorded so far
+
+    Methods:
+        record: store the result of the last frame analyzed by the eye tracker
+        flush: write the buffered records to the file
+        close: flush and close the file
+    """
+    def __init__(self, path, buffer_size=256, options=None):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.options = options
+        self.count = 0
+        self._buffer = np.zeros(buffer_size, RECORDING_DTYPE)
+        self._buffered = 0
+        self._file = open(path, 'ab')
+        self._start = time.monotonic()
+        if options is not None:
+            with open(path + '.json', 'w') as f:
+                json.dump(options, f)
+
+    def record(self, eye_tracker, mode=None, quiz=None, question=None, weight=None):
+        """
+        Quiz is the index of the quiz in the session and question the id of the current question, None outside quizzes.
+        Weight is the weight of the vote of the frame
+        """
+        slot = self._buffer[self._buffered]
+        eye_tracker.result().to_record(slot)
+        slot['mode'] = mode.value if mode is not None else -1
+        slot['quiz'] = quiz if quiz is not None else -1
+        slot['question'] = question if question is not None else -1
+        slot['weight'] = weight if weight is not None else 1.0
+        slot['time'] = time.time()
+        slot['elapsed'] = time.monotonic() - self._start
+        self._buffered += 1
+        self.count += 1
+        if self._buffered == self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self._buffered:
+            self._file.write(self._buffer[:self._buffered].tobytes())
+            self._file.flush()
+            self._buffered = 0
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,120 @@
+import os
+import sys
+import time
+import argparse
+import numpy as np
+
+from eye_tracker import EyeTracker
+from filters import GazeFilter
+from model import DIRECTIONS
+from quiz import Quiz
+from recording import read_recording, read_options
+from scheduler import Mode
+
+
+def _tuple(values):
+    return tuple(values) if values[0] >= 0 else None
+
+
+def replay_directions(records, eye_tracker=None):
+    """
+    Looking direction code and vote weight of each record, recomputed from the recorded eye boxes and pupils
+    without running the vision pipeline: by EyeTracker._extract_looking_direction, or by the gaze filter of the
+    eye tracker when it has one, fed with the analyzed records and stepped without measurement on the predicted ones
+    """
+    if eye_tracker is None:
+        eye_tracker = EyeTracker()
+    gaze_filter = eye_tracker.gaze_filter
+    directions = np.empty(len(records), np.int8)
+    weights = np.ones(len(records), np.float32)
+    # plain lists are much faster than numpy records to walk in python
+    columns = zip(records['left_eye_bb'].tolist(), records['right_eye_bb'].tolist(),
+                  records['left_pupil'].tolist(), records['right_pupil'].tolist(), records['analyzed'].tolist())
+    for i, (left_eye_bb, right_eye_bb, left_pupil, right_pupil, analyzed) in enumerate(columns):
+        if gaze_filter is not None and not analyzed:
+            gaze_filter.step()
+        else:
+            eye_tracker.left_eye_bb = _tuple(left_eye_bb)
+            eye_tracker.right_eye_bb = _tuple(right_eye_bb)
+            eye_tracker.left_eye_detected = eye_tracker.left_eye_bb is not None
+            eye_tracker.right_eye_detected = eye_tracker.right_eye_bb is not None
+            eye_tracker.left_pupil = _tuple(left_pupil)
+            eye_tracker.right_pupil = _tuple(right_pupil)
+            eye_tracker._extract_looking_direction()
+            if gaze_filter is not None:
+                gaze_filter.step(eye_tracker._pupil_position())
+        if gaze_filter is not None:
+            eye_tracker.looking_direction = gaze_filter.direction()
+            weights[i] = gaze_filter.confidence()
+        directions[i] = DIRECTIONS[eye_tracker.looking_direction]
+    return directions, weights
+
+
+def replay_quizzes(records, directions, weights=None, **quiz_options):
+    """
+    House of each quiz of the session, scoring the directions of the answering frames as the main loop does,
+    each vote with the weight of its frame (1 without weights)
+    """
+    if weights is None:
+        weights = np.ones(len(records), np.float32)
+    houses = {}
+    answering = records['mode'] == Mode.ANSWERING.value
+    for quiz_index in np.unique(records['quiz'][records['quiz'] >= 0]).tolist():
+        quiz = Quiz(**quiz_options)
+        frames = answering & (records['quiz'] == quiz_index)
+        for question, direction, weight in zip(records['question'][frames].tolist(), directions[frames].tolist(),
+                                               weights[frames].tolist()):
+            if direction == DIRECTIONS['left']:
+                quiz.add_answer(question, 'yes', weight)
+            if direction == DIRECTIONS['right']:
+                quiz.add_answer(question, 'no', weight)
+        houses[quiz_index] = quiz.compute_result()
+    return houses
+
+
+def recordings(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.endswith('.rec'):
+                    yield os.path.join(path, name)
+        else:
+            yield path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded sessions through the direction extraction and the quiz scoring")
+    parser.add_argument("recordings", nargs="+", help="recording files or directories of .rec files")
+    parser.add_argument("--check", action="store_true", help="fail if a replayed house differs from the one of the recorded directions")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    sessions = 0
+    frames = 0
+    differences = 0
+    for path in recordings(args.recordings):
+        records = read_recording(path)
+        # the quiz and the gaze filter of the recorded session, the filter starts again with each session
+        options = read_options(path)
+        quiz_options = options.get("quiz", {})
+        gaze_filter = GazeFilter(**options["gaze_filter"]) if options.get("gaze_filter") else None
+        directions, weights = replay_directions(records, EyeTracker(gaze_filter=gaze_filter))
+        recorded = replay_quizzes(records, records['direction'], records['weight'], **quiz_options)
+        replayed = replay_quizzes(records, directions, weights, **quiz_options)
+        mismatches = int((directions != records['direction']).sum())
+        sessions += 1
+        frames += len(records)
+
+        changed = [index for index in replayed if replayed[index] != recorded[index]]
+        differences += len(changed)
+        print("{}: {} frames, {} directions differ, houses {}{}".format(
+            path, len(records), mismatches, list(replayed.values()),
+            " (recorded {})".format(list(recorded.values())) if changed else ""))
+
+    print("{} sessions, {} frames replayed in {:.3f} s".format(sessions, frames, time.perf_counter() - start), file=sys.stderr)
+    if args.check and differences:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+import time
+from enum import Enum
+
+
+class Mode(Enum):
+    AWAITING = 0
+    READING = 1
+    ANSWERING = 2
+    BEGINNING = 3
+    COMPLETED = 4
+
+
+class ModeScheduler:
+    """
+    State machine of the quiz modes driven by the frame loop.
+    The timed transitions (reading -> answering -> awaiting) happen in update, called once per frame,
+    when their deadline on the clock has passed: no threads change the mode behind the loop
+    Attributes:
+        mode: current Mode
+        reading_time: seconds given to read a question
+        answering_time: seconds given to answer a question
+        clock: function returning the current time in seconds, time.monotonic by default
+        deadline: time of the next timed transition, None if the current mode has no timeout
+
+    Methods:
+        update: apply the timed transition if its deadline passed and return the current mode
+        read_question: show a new question
+        close_answers: stop collecting answers before the deadline
+        complete: show the quiz result
+        remaining: seconds left before the next timed transition
+    """
+    def __init__(self, reading_time=5, answering_time=5, clock=time.monotonic):
+        self.reading_time = reading_time
+        self.answering_time = answering_time
+        self.clock = clock
+        self.mode = Mode.BEGINNING
+        self.deadline = None
+
+    def _set(self, mode, duration=None):
+        self.mode = mode
+        self.deadline = self.clock() + duration if duration is not None else None
+
+    def update(self):
+        if self.deadline is not None and self.clock() >= self.deadline:
+            if self.mode == Mode.READING:
+                # the answering time starts from the deadline, a late frame does not stretch the quiz
+                self.mode = Mode.ANSWERING
+                self.deadline += self.answering_time
+            elif self.mode == Mode.ANSWERING:
+                self._set(Mode.AWAITING)
+        return self.mode
+
+    def read_question(self):
+        self._set(Mode.READING, self.reading_time)
+
+    def close_answers(self):
+        if self.mode == Mode.ANSWERING:
+            self._set(Mode.AWAITING)
+
+    def complete(self):
+        self._set(Mode.COMPLETED)
+
+    def remaining(self):
+        if self.deadline is None:
+            return None
+        return max(self.deadline - self.clock(), 0.0)
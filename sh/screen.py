@@ -1,10 +1,46 @@
 import numpy as np
 import os
 import cv2
-import pyautogui
 
-RES_SCREEN = pyautogui.size() # RES_SCREEN[0] -> width
-                              # RES_SCREEN[1] -> heigth
+from compositing import blend
+from text_cache import TextCache
+
+RESOURCES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resources')
+
+_screen_size = None
+
+_assets = {}
+
+
+def screen_size():
+    """
+    Resolution of the display as (width, height). The display is probed only the first time,
+    so that modules using Screen can be imported without pyautogui or a display
+    """
+    global _screen_size
+    if _screen_size is None:
+        import pyautogui
+        _screen_size = tuple(pyautogui.size())
+    return _screen_size
+
+
+def load_asset(name, height):
+    """
+    Return the BGRA image resources/<name>.png resized to the given height, or None if it does not exist.
+    Images are read and resized only the first time
+    """
+    key = (name, height)
+    if key not in _assets:
+        image = None
+        path = os.path.join(RESOURCES_DIR, name + '.png')
+        if os.path.isfile(path):
+            image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+            ratio = height / image.shape[0]
+            image = cv2.resize(image, (int(image.shape[1] * ratio), int(image.shape[0] * ratio)))
+        _assets[key] = image
+    return _assets[key]
+
+
 class Screen:
     """
     Class for a screen
@@ -14,6 +50,13 @@ class Screen:
         width: screen width in pixels
         height: screnn height in pixels
         current_answer: current selected answer between 'yes' or 'no'
+        text: cache of the rasterized lines of text
+
+    Methods:
+        draw_header: draw title or question on the top of the screen, only if they changed
+        draw_panel: draw the answers panel on the bottom of the screen, only if it changed
+        draw_result: draw the final result, only if it changed
+        show: present the screen, only if it changed since the last time
     """
     def __init__(self, width=1280, height=720):
         self.width = width
@@ -22,14 +65,21 @@ class Screen:
         self.screen = np.ones((self.height, self.width, 4), np.uint8)
         self.screen[:] = self.background_color
         self.current_answer = None
+        self._layers = {}
+        self._regions = {}
+        self._changed = True
+        self._window = False
+        self.text = TextCache()
         self.print_instructions()
         self.print_title()
 
     def clean_answers(self):
+        self._changed = True
         cv2.rectangle(self.screen, (0,self.height // 3), (self.width, self.height), self.background_color, -1)
         self.print_answers()
 
     def color_answers(self):
+        self._changed = True
         cv2.rectangle(self.screen, (0,self.height // 3), (self.width, self.height), self.background_color, -1)
         if self.current_answer == 'yes':
             cv2.rectangle(self.screen, (0, self.height // 3), (self.width // 2, self.height), (0,0,255), -1)
@@ -39,6 +89,7 @@ class Screen:
         self.print_answers()
 
     def confirm_answer(self, answer):
+        self._changed = True
         cv2.rectangle(self.screen, (0,self.height // 3), (self.width, self.height), self.background_color, -1)
         if answer == 'yes':
             cv2.rectangle(self.screen, (0, self.height // 3), (self.width // 2, self.height), (0,255,0), -1)
@@ -53,38 +104,40 @@ class Screen:
         if direction == 'right':
             self.current_answer = 'no'
 
-    def clean(self):
-        self.screen = np.ones((self.height, self.width, 4), np.uint8)
-        self.screen[:] = self.background_color
-
-        if os.path.isfile((os.path.join('resources', 'sorting_hat.png'))):
-            sh_image = cv2.imread(os.path.join('resources','sorting_hat.png'), cv2.IMREAD_UNCHANGED)
-
-            height, width, channels = sh_image.shape
-
-            ratio = (self.height/3) / height
-            sh_image = cv2.resize(sh_image, (int(width * ratio),int(height * ratio)))
-
-            height, width, channels = sh_image.shape
-            offset_x = self.width - width
-            offset_y = 0
-
-            background = self.screen[offset_y:offset_y + height, offset_x:offset_x + width, :]
-            foreground = sh_image
-
-            # normalize alpha channels from 0-255 to 0-1
-            alpha_background = background[:,:,3] / 255.0
-            alpha_foreground = foreground[:,:,3] / 255.0
-
-            # set adjusted colors
-            for color in range(0, 3):
-                background[:,:,color] = alpha_foreground * foreground[:,:,color] + alpha_background * background[:,:,color] * (1 - alpha_foreground)
-
-            # set adjusted alpha and denormalize back to 0-255
-            background[:,:,3] = (1 - (1 - alpha_foreground) * (1 - alpha_background)) * 255
-
+    def clean(self, title=False, instructions=False):
+        """
+        Reset the screen to the background layer: background color, sorting hat and optionally title and instructions
+        """
+        self._changed = True
+        self._regions = {}
+        np.copyto(self.screen, self._layer(title, instructions))
+
+    def _layer(self, title, instructions):
+        """
+        Return the background layer, each combination is composited only the first time
+        """
+        key = (title, instructions)
+        if key not in self._layers:
+            screen = self.screen
+
+            self.screen = np.ones((self.height, self.width, 4), np.uint8)
+            self.screen[:] = self.background_color
+
+            sh_image = load_asset('sorting_hat', self.height / 3)
+            if sh_image is not None:
+                blend(self.screen, sh_image, self.width - sh_image.shape[1], 0)
+
+            if title:
+                self.print_title()
+            if instructions:
+                self.print_instructions()
+
+            self._layers[key] = self.screen
+            self.screen = screen
+        return self._layers[key]
 
     def print_answers(self):
+        self._changed = True
 
         font = cv2.FONT_HERSHEY_SIMPLEX
         fs = 2
@@ -93,23 +146,24 @@ class Screen:
         answer = 'Look left\nfor YES'
 
         for i, line in enumerate(answer.split('\n')):
-            textsize = cv2.getTextSize(line, font, fs, th)[0]
+            textsize = self.text.get_text_size(line, font, fs, th)[0]
             x = (self.width // 2 - textsize[0]) // 2
             y0, dy = self.height // 3 + ((2 * (self.height // 3) + textsize[1]) // 2) - textsize[1], textsize[1] + 30
             y = y0 + i*dy
-            cv2.putText(img=self.screen, text=line, org=(x, y),fontFace=font, fontScale=fs, color=(0,0,0), thickness=th)
+            self.text.put_text(self.screen, line, (x, y), font, fs, (0,0,0), th)
 
         answer = 'Look right\nfor NO'
 
         for i, line in enumerate(answer.split('\n')):
-            textsize = cv2.getTextSize(line, font, fs, th)[0]
+            textsize = self.text.get_text_size(line, font, fs, th)[0]
             x = self.width // 2 + (self.width // 2 - textsize[0]) // 2
             y0, dy = self.height // 3 + ((2 * (self.height // 3) + textsize[1]) // 2) - textsize[1], textsize[1] + 30
             y = y0 + i*dy
-            cv2.putText(img=self.screen, text=line, org=(x, y),fontFace=font, fontScale=fs, color=(0,0,0), thickness=th)
+            self.text.put_text(self.screen, line, (x, y), font, fs, (0,0,0), th)
 
 
     def print_question(self, question):
+        self._changed = True
         font = cv2.FONT_HERSHEY_SIMPLEX
         fs = 1.2
         th = 3
@@ -117,24 +171,26 @@ class Screen:
         y0, dy = int(0.15 * self.height), 35
 
         for i, line in enumerate(question.split('\n')):
-            textsize = cv2.getTextSize(line, font, fs, th)[0]
+            textsize = self.text.get_text_size(line, font, fs, th)[0]
             x = self.width // 4 + (self.width // 2 - textsize[0]) // 2
             y = y0 + i*dy
-            cv2.putText(img=self.screen, text=line, org=(x, y),fontFace=font, fontScale=fs, color=(0,0,0), thickness=th)
+            self.text.put_text(self.screen, line, (x, y), font, fs, (0,0,0), th)
 
     def print_title(self):
+        self._changed = True
 
         font = cv2.FONT_HERSHEY_SIMPLEX
         fs = 1.7
         th = 5
         line = 'HI, I\'M THE SORTING HAT'
-        textsize = cv2.getTextSize(line, font, fs, th)[0]
+        textsize = self.text.get_text_size(line, font, fs, th)[0]
         x = self.width // 4 + (self.width // 2 - textsize[0]) // 2
         y = int(0.1 * self.height) + textsize[1]
-        cv2.putText(img=self.screen, text=line, org=(x, y),fontFace=font, fontScale=fs, color=(0,0,0), thickness=th)
+        self.text.put_text(self.screen, line, (x, y), font, fs, (0,0,0), th)
 
 
     def print_instructions(self):
+        self._changed = True
 
         font = cv2.FONT_HERSHEY_SIMPLEX
         fs = 0.8
@@ -145,64 +201,95 @@ class Screen:
 
         for i, line in enumerate(instructions.split('\n')):
             y = y0 + i*dy
-            cv2.putText(img=self.screen, text=line, org=(x, y), fontFace=font, fontScale=fs, color=(0,0,0), thickness=th)
+            self.text.put_text(self.screen, line, (x, y), font, fs, (0,0,0), th)
 
     def show_result(self, result):
+        self._changed = True
         font = cv2.FONT_HERSHEY_SIMPLEX
         fs = 1.5
         th = 3
         line = 'The Sorting Hat says...'
-        textsize = cv2.getTextSize(line, font, fs, th)[0]
+        textsize = self.text.get_text_size(line, font, fs, th)[0]
         x = self.width // 4 + (self.width // 2 - textsize[0]) // 2
         y = int(0.15 * self.height) + textsize[1]
-        cv2.putText(img=self.screen, text=line, org=(x, y),fontFace=font, fontScale=fs, color=(0,0,0), thickness=th)
+        self.text.put_text(self.screen, line, (x, y), font, fs, (0,0,0), th)
 
         font = cv2.FONT_HERSHEY_SIMPLEX
         fs = 2.5
         th = 5
         line = result.upper()
-        textsize = cv2.getTextSize(line, font, fs, th)[0]
+        textsize = self.text.get_text_size(line, font, fs, th)[0]
         x = (self.width - textsize[0]) // 2
         y = int(0.85 * self.height) - textsize[1]
-        cv2.putText(img=self.screen, text=line, org=(x, y),fontFace=font, fontScale=fs, color=(0,0,0), thickness=th)
-
-        if os.path.isfile((os.path.join('resources', result.lower()+'.png'))):
-            house_image = cv2.imread(os.path.join('resources',result.lower()+'.png'), cv2.IMREAD_UNCHANGED)
-
-            height, width, channels = house_image.shape
-
-            ratio = self.height / height
-            house_image = cv2.resize(house_image, (int(width * ratio),int(height * ratio)))
+        self.text.put_text(self.screen, line, (x, y), font, fs, (0,0,0), th)
 
+        house_image = load_asset(result.lower(), self.height)
+        if house_image is not None:
             height, width, channels = house_image.shape
             offset_x = self.width - width
             offset_y = 0
 
             self.screen[offset_y:offset_y + height, offset_x:offset_x + width, :] = self.background_color
-            background = self.screen[offset_y:offset_y + height, offset_x:offset_x + width, :]
-            foreground = house_image
-
-            # normalize alpha channels from 0-255 to 0-1
-            alpha_background = background[:,:,3] / 255.0
-            alpha_foreground = foreground[:,:,3] / 255.0
-
-            # set adjusted colors
-            for color in range(0, 3):
-                background[:,:,color] = alpha_foreground * foreground[:,:,color] + alpha_background * background[:,:,color] * (1 - alpha_foreground)
-
-            # set adjusted alpha and denormalize back to 0-255
-            background[:,:,3] = (1 - (1 - alpha_foreground) * (1 - alpha_background)) * 255
-
+            blend(self.screen, house_image, offset_x, offset_y)
 
         self.show()
 
+    def _restore(self, key, y0, y1, title=False):
+        """
+        Restore the rows y0:y1 of the screen from the background layer if the region content changed.
+        Return False if the region already shows that content
+        """
+        if self._regions.get((y0, y1)) == key:
+            return False
+        np.copyto(self.screen[y0:y1], self._layer(title, True)[y0:y1])
+
+        # forget the regions overwritten by this one
+        self._regions = {r: k for r, k in self._regions.items() if r[1] <= y0 or r[0] >= y1}
+        self._regions[(y0, y1)] = key
+        self._changed = True
+        return True
+
+    def draw_header(self, title=False, question=None):
+        key = ('title',) if title else ('question', question)
+        if self._restore(key, 0, self.height // 3, title=title) and question:
+            self.print_question(question)
+
+    def draw_panel(self, direction=None, confirmed=None, answers=True):
+        if direction:
+            self.update_direction(direction)
+        if confirmed:
+            key = ('confirm', confirmed)
+        elif direction:
+            key = ('answers', self.current_answer)
+        else:
+            key = ('answers', None) if answers else ('empty',)
+
+        if not self._restore(key, self.height // 3, self.height):
+            return
+        if confirmed:
+            self.confirm_answer(confirmed)
+        elif direction:
+            self.color_answers()
+        elif answers:
+            self.clean_answers()
+
+    def draw_result(self, result):
+        if self._restore(('result', result), 0, self.height):
+            self.show_result(result)
+
     def show(self):
-        cv2.namedWindow("screen")
-        cv2.moveWindow("screen", int(RES_SCREEN[0] / 2 - self.width/2), 0)
+        if not self._changed:
+            return
+
+        if not self._window:
+            cv2.namedWindow("screen")
+            cv2.moveWindow("screen", int(screen_size()[0] / 2 - self.width/2), 0)
+            self._window = True
 
 #        cv2.namedWindow("screen", cv2.WND_PROP_FULLSCREEN)
 #        cv2.setWindowProperty("screen",cv2.WND_PROP_FULLSCREEN,cv2.WINDOW_FULLSCREEN)
         cv2.imshow("screen", self.screen)
+        self._changed = False
 
 
 
@@ -0,0 +1,236 @@
+import sys
+import json
+import time
+import socket
+import struct
+import asyncio
+import argparse
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from eye_tracker import EyeTracker
+from headless import frame_result
+from detectors import FACE_DETECTORS
+
+
+# each message is a header and a payload, preceded by their lengths
+MESSAGE_LENGTHS = struct.Struct("!II")
+
+
+def encode_message(header, payload=b""):
+    header = json.dumps(header).encode()
+    return MESSAGE_LENGTHS.pack(len(header), len(payload)) + header + payload
+
+
+def decode_frame(header, payload):
+    """
+    Frame sent by a client: a JPEG (or any format imdecode reads) or raw BGR pixels of the given shape
+    """
+    if header.get("format", "jpeg") == "raw":
+        return np.frombuffer(payload, np.uint8).reshape(header["shape"])
+    return cv2.imdecode(np.frombuffer(payload, np.uint8), cv2.IMREAD_COLOR)
+
+
+class _Request:
+    __slots__ = ('client', 'header', 'payload', 'future')
+
+    def __init__(self, client, header, payload, future):
+        self.client = client
+        self.header = header
+        self.payload = payload
+        self.future = future
+
+
+class AnalysisService:
+    """
+    Local service analyzing the frames sent by thin clients with an EyeTracker per client.
+    An asyncio front end reads the requests of all the connections, a dispatcher collects them in batches
+    and a pool of worker threads analyzes each batch, the frames of a client in order on its own tracker
+    Attributes:
+        workers: number of worker threads
+        max_batch: maximum number of frames in a batch
+        batch_window: seconds the dispatcher waits for more frames after the first of a batch
+        tracker_options: options of the EyeTracker of each client
+        trackers: EyeTracker of each connected client
+        batches: number of batches analyzed
+        frames: number of frames analyzed
+
+    Methods:
+        serve: accept clients on a unix socket or a localhost TCP port until cancelled
+    """
+    def __init__(self, workers=4, max_batch=32, batch_window=0.002, **tracker_options):
+        self.workers = workers
+        self.max_batch = max_batch
+        self.batch_window = batch_window
+        self.tracker_options = tracker_options
+        self.trackers = {}
+        self.batches = 0
+        self.frames = 0
+        self._client_ids = itertools.count()
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="analysis")
+        self._queue = None
+
+    async def serve(self, path=None, host="127.0.0.1", port=8765):
+        self._queue = asyncio.Queue()
+        dispatcher = asyncio.ensure_future(self._dispatch())
+        if path:
+            server = await asyncio.start_unix_server(self._handle_client, path)
+        else:
+            server = await asyncio.start_server(self._handle_client, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            dispatcher.cancel()
+            self._executor.shutdown(wait=False)
+
+    async def _handle_client(self, reader, writer):
+        client = next(self._client_ids)
+        # sticky tracker: the face tracking of a client needs its frames in order on the same tracker
+        self.trackers[client] = EyeTracker(**self.tracker_options)
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    lengths = await reader.readexactly(MESSAGE_LENGTHS.size)
+                except asyncio.IncompleteReadError:
+                    break
+                header_length, payload_length = MESSAGE_LENGTHS.unpack(lengths)
+                header = json.loads(await reader.readexactly(header_length))
+                payload = await reader.readexactly(payload_length)
+
+                future = loop.create_future()
+                await self._queue.put(_Request(client, header, payload, future))
+                writer.write(encode_message(await future))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            del self.trackers[client]
+            writer.close()
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            # wait a little for the frames of the other clients
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            by_client = {}
+            for request in batch:
+                by_client.setdefault(request.client, []).append(request)
+
+            # one job per client, so that a tracker is never used by two threads,
+            # and the next batch waits for this one for the same reason
+            jobs = [loop.run_in_executor(self._executor, self._analyze, client, requests)
+                    for client, requests in by_client.items()]
+            for requests, results in zip(by_client.values(), await asyncio.gather(*jobs, return_exceptions=True)):
+                for i, request in enumerate(requests):
+                    if request.future.done():
+                        continue
+                    if isinstance(results, Exception):
+                        request.future.set_result({"error": str(results)})
+                    else:
+                        request.future.set_result(results[i])
+            self.batches += 1
+            self.frames += len(batch)
+
+    def _analyze(self, client, requests):
+        eye_tracker = self.trackers.get(client)
+        results = []
+        for request in requests:
+            frame = decode_frame(request.header, request.payload)
+            if frame is None or eye_tracker is None:
+                results.append({"error": "invalid frame"})
+                continue
+            start = time.perf_counter()
+            eye_tracker.update(frame)
+            end = time.perf_counter()
+            results.append(frame_result(eye_tracker, request.header.get("frame", eye_tracker.frame_count), end - start))
+        return results
+
+
+class ServiceClient:
+    """
+    Blocking client of the analysis service, for the kiosks
+    Methods:
+        analyze: send a frame and return its result as a dictionary
+        close: close the connection
+    """
+    def __init__(self, path=None, host="127.0.0.1", port=8765, jpeg_quality=90):
+        if path:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.connect(path)
+        else:
+            self._socket = socket.create_connection((host, port))
+        self.jpeg_quality = jpeg_quality
+
+    def analyze(self, frame, frame_index=None, raw=False):
+        header = {"format": "raw" if raw else "jpeg"}
+        if frame_index is not None:
+            header["frame"] = frame_index
+        if raw:
+            header["shape"] = frame.shape
+            payload = np.ascontiguousarray(frame).tobytes()
+        else:
+            _, payload = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+            payload = payload.tobytes()
+        self._socket.sendall(encode_message(header, payload))
+
+        header_length, payload_length = MESSAGE_LENGTHS.unpack(self._receive(MESSAGE_LENGTHS.size))
+        result = json.loads(self._receive(header_length))
+        self._receive(payload_length)
+        return result
+
+    def _receive(self, size):
+        data = bytearray()
+        while len(data) < size:
+            chunk = self._socket.recv(size - len(data))
+            if not chunk:
+                raise ConnectionError("the service closed the connection")
+            data += chunk
+        return bytes(data)
+
+    def close(self):
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the eye tracker to the stations of the local network or host")
+    parser.add_argument("-u", "--unix-socket", default=None, help="path of the unix socket to listen on")
+    parser.add_argument("-p", "--port", type=int, default=8765, help="localhost TCP port to listen on, without unix socket")
+    parser.add_argument("-w", "--workers", type=int, default=4, help="number of analysis threads")
+    parser.add_argument("--max-batch", type=int, default=32, help="maximum number of frames analyzed in a batch")
+    parser.add_argument("--batch-window", type=float, default=2, help="milliseconds waited to fill a batch")
+    parser.add_argument("-f", "--face-detector", default="haar", choices=list(FACE_DETECTORS), help="face detector backend")
+    parser.add_argument("-t", "--threshold", type=int, default=25, help="pupil binarization threshold")
+    args = parser.parse_args()
+
+    service = AnalysisService(args.workers, args.max_batch, args.batch_window / 1000, threshold=args.threshold, face_detector=args.face_detector)
+    print("listening on {}".format(args.unix_socket or "127.0.0.1:{}".format(args.port)), file=sys.stderr)
+    try:
+        asyncio.run(service.serve(args.unix_socket, port=args.port))
+    except KeyboardInterrupt:
+        pass
+    print("{} frames in {} batches".format(service.frames, service.batches), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+import os
+import time
+import queue
+import argparse
+import multiprocessing
+
+# start of the process before the heavy imports, the spawned workers import this module again
+STARTED = time.perf_counter()
+
+import cv2
+
+from eye_tracker import EyeTracker
+from frame_source import CameraSource, open_source
+from capture import ThreadedCapture
+from headless import frame_result
+from detectors import FACE_DETECTORS
+
+
+def _pin_to_core(core):
+    """
+    Bind the current process to a single cpu core, where the platform allows it
+    """
+    if core is None or not hasattr(os, "sched_setaffinity"):
+        return
+    try:
+        os.sched_setaffinity(0, {core})
+    except OSError:
+        pass
+
+
+# seconds a worker waits for a camera frame before checking again whether it has to stop
+READ_TIMEOUT = 0.5
+
+
+def _frames(camera, stop):
+    """
+    Frames of a station source until it ends or the worker is asked to stop.
+    A stalled live camera is waited for, checking the stop event between reads, and only a finished source ends it
+    """
+    while not stop.is_set():
+        if isinstance(camera, ThreadedCapture):
+            ok, frame = camera.read(READ_TIMEOUT)
+            if not ok:
+                if camera.exhausted:
+                    return
+                continue
+        else:
+            ok, frame = camera.read()
+            if not ok:
+                return
+        yield frame
+
+
+def station_worker(station, source_spec, core, results, stop, tracker_options):
+    """
+    Worker process of a station: it runs its own EyeTracker on its camera and sends each frame result to the supervisor
+    """
+    camera = None
+    startup = True
+    # the supervisor waits for the stopped message, so it is sent even when the setup fails
+    try:
+        _pin_to_core(core)
+        # one core per station, so no opencv thread pool inside the worker
+        cv2.setNumThreads(1)
+
+        eye_tracker = EyeTracker(**tracker_options)
+        camera = open_source(source_spec)
+        if isinstance(camera, CameraSource):
+            # live cameras keep only the newest frame, recordings are replayed frame by frame
+            camera = ThreadedCapture(camera).start()
+
+        for frame in _frames(camera, stop):
+            start = time.perf_counter()
+            eye_tracker.update(frame)
+            end = time.perf_counter()
+
+            result = frame_result(eye_tracker, camera.frame_index, end - start)
+            result["station"] = station
+            result["dropped_frames"] = getattr(camera, "dropped_frames", 0)
+            if startup:
+                # time to the first analyzed frame of the worker process
+                result["startup_ms"] = round((time.perf_counter() - STARTED) * 1000, 3)
+                startup = False
+            try:
+                results.put_nowait(result)
+            except queue.Full:
+                # the supervisor is behind, the next result supersedes this one
+                pass
+    finally:
+        if camera is not None:
+            camera.release()
+        results.put({"station": station, "stopped": True})
+
+
+class StationSupervisor:
+    """
+    Run one EyeTracker worker process per camera and collect their results
+    Attributes:
+        sources: list of camera indexes, video files or image directories, one per station
+        cores: cpu core assigned to each station, None to leave the scheduling to the system
+        directions: last looking direction of each station
+        latencies: last tracker time in milliseconds of each station
+        startup_times: milliseconds from the start of each worker process to its first analyzed frame
+
+    Methods:
+        start: start the worker processes
+        poll: collect the available results and return them
+        stop: stop the worker processes
+    """
+    def __init__(self, sources, cores=None, queue_size=256, **tracker_options):
+        self.sources = list(sources)
+        if cores is None:
+            available = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+            cores = [available[i % len(available)] if available else None for i in range(len(self.sources))]
+        self.cores = list(cores)
+        self.tracker_options = tracker_options
+
+        context = multiprocessing.get_context("spawn")
+        self._results = context.Queue(queue_size)
+        self._stop = context.Event()
+        self._processes = [
+            context.Process(target=station_worker, name="station-{}".format(station),
+                            args=(station, source, core, self._results, self._stop, tracker_options), daemon=True)
+            for station, (source, core) in enumerate(zip(self.sources, self.cores))
+        ]
+        self._running = set()
+
+        self.directions = {station: None for station in range(len(self.sources))}
+        self.latencies = {station: None for station in range(len(self.sources))}
+        self.startup_times = {station: None for station in range(len(self.sources))}
+
+    def start(self):
+        for station, process in enumerate(self._processes):
+            process.start()
+            self._running.add(station)
+        return self
+
+    def is_running(self):
+        self._drop_dead()
+        return len(self._running) > 0
+
+    def _drop_dead(self):
+        # a worker killed without sending its stopped message (crash, oom kill) is not running anymore
+        for station in list(self._running):
+            if self._processes[station].exitcode is not None:
+                self._running.discard(station)
+
+    def poll(self, timeout=0.1):
+        results = []
+        try:
+            result = self._results.get(timeout=timeout)
+            while True:
+                if result.get("stopped"):
+                    self._running.discard(result["station"])
+                else:
+                    self.directions[result["station"]] = result["direction"]
+                    self.latencies[result["station"]] = result["time_ms"]
+                    if "startup_ms" in result:
+                        self.startup_times[result["station"]] = result["startup_ms"]
+                    results.append(result)
+                result = self._results.get_nowait()
+        except queue.Empty:
+            pass
+        self._drop_dead()
+        return results
+
+    def stop(self):
+        self._stop.set()
+        # drain the queue so that workers blocked on it can exit
+        deadline = time.monotonic() + 5
+        while self.is_running() and time.monotonic() < deadline:
+            self.poll()
+        for process in self._processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive several sorting stations from one host")
+    parser.add_argument("sources", nargs="+", help="camera index, video file or directory of images of each station")
+    parser.add_argument("--cores", type=int, nargs="+", default=None, help="cpu core of each station")
+    parser.add_argument("-f", "--face-detector", default="haar", choices=list(FACE_DETECTORS), help="face detector backend")
+    parser.add_argument("-t", "--threshold", type=int, default=25, help="pupil binarization threshold")
+    args = parser.parse_args()
+
+    if args.cores is not None and len(args.cores) != len(args.sources):
+        parser.error("one core is needed for each station")
+
+    with StationSupervisor(args.sources, args.cores, threshold=args.threshold, face_detector=args.face_detector) as supervisor:
+        try:
+            last_report = time.monotonic()
+            while supervisor.is_running():
+                supervisor.poll()
+                if time.monotonic() - last_report >= 1:
+                    last_report = time.monotonic()
+                    for station in supervisor.directions:
+                        latency = supervisor.latencies[station]
+                        print("STATION {}: direction {}, {}".format(station, supervisor.directions[station],
+                              "{:.3f} ms".format(latency) if latency is not None else "no frames"))
+        except KeyboardInterrupt:
+            pass
+        for station, startup in supervisor.startup_times.items():
+            if startup is not None:
+                print("STATION {}: first frame analyzed {:.3f} s after the start of the worker".format(station, startup / 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,222 @@
+import os
+import json
+import time
+import threading
+from collections import deque
+import numpy as np
+
+from model import DIRECTIONS, DIRECTION_NAMES
+
+
+STAGES = ('gray', 'face', 'eyes', 'left_pupil', 'right_pupil', 'direction', 'total')
+
+FEATURES = ('face', 'left_eye', 'right_eye', 'left_pupil', 'right_pupil')
+
+RECORD_DTYPE = np.dtype(
+    [('time', 'f8'), ('frame', 'i8'), ('mode', 'i1'), ('quality', 'i1'), ('direction', 'i1'), ('dropped_frames', 'i8'), ('analyzed', 'u1')]
+    # 1 detected, 0 missed, -1 unknown on the frames predicted by the gaze filter
+    + [(feature + '_detected', 'i1') for feature in FEATURES]
+    + [(stage + '_time', 'f4') for stage in STAGES]
+)
+
+
+class Telemetry:
+    """
+    Per-frame telemetry of the eye tracker.
+    The analysis loop writes each frame in a preallocated ring buffer without locks (single writer),
+    a background thread exports the new records as JSON lines and rewrites a Prometheus text file
+    Attributes:
+        capacity: number of frames kept in the ring buffer
+        jsonl_path: file where the records are appended as JSON lines, None to disable
+        prometheus_path: file rewritten with the aggregated metrics in Prometheus text format, None to disable
+        flush_interval: seconds between two exports
+        overruns: number of records overwritten before the flusher could export them
+
+    Methods:
+        record: store the results of the last analyzed frame
+        record_mode: store a mode transition
+        start: start the background flusher
+        flush: export the records not exported yet
+        stop: stop the background flusher, exporting the last records
+    """
+    def __init__(self, capacity=4096, jsonl_path=None, prometheus_path=None, flush_interval=1.0):
+        self.capacity = capacity
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.flush_interval = flush_interval
+        self.overruns = 0
+
+        self._buffer = np.zeros(capacity, RECORD_DTYPE)
+        self._written = 0
+        self._exported = 0
+        self._events = deque()
+
+        self._frames = 0
+        self._analyzed = 0
+        self._detections = dict.fromkeys(FEATURES + ('direction',), 0)
+        self._stage_sum = dict.fromkeys(STAGES, 0.0)
+        self._stage_count = dict.fromkeys(STAGES, 0)
+        self._transitions = {}
+        self._mode = None
+        self._quality = None
+        self._dropped_frames = 0
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def record(self, eye_tracker, frame_index, mode=None, dropped_frames=0, total_time=None, quality=None):
+        """
+        Called by the analysis loop after each frame, it only writes a slot of the ring buffer
+        """
+        slot = self._buffer[self._written % self.capacity]
+        slot['time'] = time.time()
+        slot['frame'] = frame_index
+        slot['mode'] = mode.value if mode is not None else -1
+        slot['quality'] = quality if quality is not None else -1
+        slot['dropped_frames'] = dropped_frames
+
+        slot['direction'] = DIRECTIONS.get(eye_tracker.looking_direction, -1)
+        slot['analyzed'] = eye_tracker.analyzed
+        for feature in FEATURES:
+            slot[feature + '_detected'] = getattr(eye_tracker, feature + '_detected') if eye_tracker.analyzed else -1
+
+        stage_times = eye_tracker.stage_times
+        for stage in STAGES[:-1]:
+            slot[stage + '_time'] = stage_times.get(stage, np.nan)
+        slot['total_time'] = total_time if total_time is not None else sum(stage_times.values())
+
+        # publish the record only once it is complete
+        self._written += 1
+
+    def record_mode(self, old_mode, new_mode):
+        self._events.append({"time": time.time(), "event": "mode", "from": old_mode.name if old_mode else None, "to": new_mode.name})
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="telemetry", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _new_records(self):
+        written = self._written
+        if written - self._exported > self.capacity:
+            self.overruns += written - self._exported - self.capacity
+            self._exported = written - self.capacity
+        start, end = self._exported % self.capacity, written % self.capacity
+        if written == self._exported:
+            records = self._buffer[:0]
+        elif start < end:
+            records = self._buffer[start:end]
+        else:
+            records = np.concatenate((self._buffer[start:], self._buffer[:end]))
+        # copy before the writer reuses the slots
+        records = records.copy()
+        self._exported = written
+        return records
+
+    def flush(self):
+        records = self._new_records()
+        events = []
+        while self._events:
+            events.append(self._events.popleft())
+
+        self._aggregate(records, events)
+
+        if self.jsonl_path:
+            with open(self.jsonl_path, 'a') as f:
+                for record in records:
+                    f.write(json.dumps(self._as_dict(record)) + "\n")
+                for event in events:
+                    f.write(json.dumps(event) + "\n")
+
+        if self.prometheus_path:
+            self._write_prometheus()
+
+    def _as_dict(self, record):
+        result = {
+            "time": record['time'].item(),
+            "frame": record['frame'].item(),
+            "mode": record['mode'].item(),
+            "quality": record['quality'].item(),
+            "direction": DIRECTION_NAMES.get(record['direction'].item()),
+            "dropped_frames": record['dropped_frames'].item(),
+            "analyzed": bool(record['analyzed']),
+        }
+        for feature in FEATURES:
+            detected = record[feature + '_detected'].item()
+            result[feature + '_detected'] = None if detected < 0 else bool(detected)
+        for stage in STAGES:
+            value = record[stage + '_time'].item()
+            result[stage + '_ms'] = None if np.isnan(value) else round(value * 1000, 3)
+        return result
+
+    def _aggregate(self, records, events):
+        if len(records):
+            self._frames += len(records)
+            self._analyzed += int(records['analyzed'].sum())
+            for feature in FEATURES:
+                self._detections[feature] += int((records[feature + '_detected'] == 1).sum())
+            self._detections['direction'] += int((records['direction'] >= 0).sum())
+            for stage in STAGES:
+                values = records[stage + '_time'][~np.isnan(records[stage + '_time'])]
+                self._stage_sum[stage] += float(values.sum())
+                self._stage_count[stage] += len(values)
+            self._mode = int(records['mode'][-1])
+            self._quality = int(records['quality'][-1])
+            self._dropped_frames = int(records['dropped_frames'][-1])
+        for event in events:
+            key = (event['from'], event['to'])
+            self._transitions[key] = self._transitions.get(key, 0) + 1
+
+    def _write_prometheus(self):
+        # quantiles over the frames still in the ring buffer
+        recent = self._buffer[:min(self._written, self.capacity)].copy()
+
+        lines = [
+            "# TYPE sortinghat_frames_total counter",
+            "sortinghat_frames_total {}".format(self._frames),
+            # the detection rates are relative to the analyzed frames, the others are predicted
+            "# TYPE sortinghat_analyzed_frames_total counter",
+            "sortinghat_analyzed_frames_total {}".format(self._analyzed),
+            "# TYPE sortinghat_dropped_frames_total counter",
+            "sortinghat_dropped_frames_total {}".format(self._dropped_frames),
+            "# TYPE sortinghat_telemetry_overruns_total counter",
+            "sortinghat_telemetry_overruns_total {}".format(self.overruns),
+            "# TYPE sortinghat_mode gauge",
+            "sortinghat_mode {}".format(self._mode if self._mode is not None else -1),
+            "# TYPE sortinghat_quality_level gauge",
+            "sortinghat_quality_level {}".format(self._quality if self._quality is not None else -1),
+            "# TYPE sortinghat_detections_total counter",
+        ]
+        for feature in self._detections:
+            lines.append('sortinghat_detections_total{{feature="{}"}} {}'.format(feature, self._detections[feature]))
+
+        lines.append("# TYPE sortinghat_stage_seconds summary")
+        for stage in STAGES:
+            values = recent[stage + '_time'][~np.isnan(recent[stage + '_time'])]
+            if len(values):
+                for q in (0.5, 0.95, 0.99):
+                    lines.append('sortinghat_stage_seconds{{stage="{}",quantile="{}"}} {:.6f}'.format(stage, q, np.quantile(values, q)))
+            lines.append('sortinghat_stage_seconds_sum{{stage="{}"}} {:.6f}'.format(stage, self._stage_sum[stage]))
+            lines.append('sortinghat_stage_seconds_count{{stage="{}"}} {}'.format(stage, self._stage_count[stage]))
+
+        lines.append("# TYPE sortinghat_mode_transitions_total counter")
+        for (old, new), count in self._transitions.items():
+            lines.append('sortinghat_mode_transitions_total{{from="{}",to="{}"}} {}'.format(old, new, count))
+
+        # replace the file at once, so that scrapers never read half of it
+        temp_path = self.prometheus_path + ".tmp"
+        with open(temp_path, 'w') as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(temp_path, self.prometheus_path)
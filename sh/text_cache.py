@@ -0,0 +1,78 @@
+from collections import OrderedDict
+import numpy as np
+import cv2
+
+
+class TextSprite:
+    """
+    Model class for a rasterized line of text
+    Attributes:
+        mask: uint8 image, non zero where the text is drawn
+        size: (width, height) of the text as returned by cv2.getTextSize
+        baseline: baseline of the text as returned by cv2.getTextSize
+        origin: (x, y) position in the mask of the bottom-left corner of the text, as the org argument of cv2.putText
+    """
+    def __init__(self, mask, size, baseline, origin):
+        self.mask = mask
+        self.size = size
+        self.baseline = baseline
+        self.origin = origin
+
+
+class TextCache:
+    """
+    Rasterize each (text, font, scale, thickness) combination once and blit it afterwards.
+    The number of cached sprites is bounded, the least recently used are discarded first
+    Attributes:
+        maxsize: maximum number of cached sprites
+
+    Methods:
+        get_text_size: same result as cv2.getTextSize
+        put_text: same result as cv2.putText with the default line type, pixel for pixel when the text fits in the image
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._sprites = OrderedDict()
+
+    def sprite(self, text, font, scale, thickness):
+        key = (text, font, scale, thickness)
+        sprite = self._sprites.get(key)
+        if sprite is not None:
+            self._sprites.move_to_end(key)
+            return sprite
+
+        (width, height), baseline = cv2.getTextSize(text, font, scale, thickness)
+        # glyphs may overflow the size computed by opencv by about the stroke thickness
+        pad = thickness + 2
+        mask = np.zeros((height + baseline + 2 * pad, width + 2 * pad), np.uint8)
+        origin = (pad, pad + height)
+        cv2.putText(img=mask, text=text, org=origin, fontFace=font, fontScale=scale, color=255, thickness=thickness)
+
+        sprite = TextSprite(mask, (width, height), baseline, origin)
+        self._sprites[key] = sprite
+        if len(self._sprites) > self.maxsize:
+            self._sprites.popitem(last=False)
+        return sprite
+
+    def get_text_size(self, text, font, scale, thickness):
+        sprite = self.sprite(text, font, scale, thickness)
+        return sprite.size, sprite.baseline
+
+    def put_text(self, img, text, org, font, scale, color, thickness):
+        sprite = self.sprite(text, font, scale, thickness)
+        mask_height, mask_width = sprite.mask.shape
+        x = org[0] - sprite.origin[0]
+        y = org[1] - sprite.origin[1]
+
+        # clip the sprite to the image
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + mask_width, img.shape[1]), min(y + mask_height, img.shape[0])
+        if x0 >= x1 or y0 >= y1:
+            return img
+
+        mask = sprite.mask[y0 - y:y1 - y, x0 - x:x1 - x]
+        channels = img.shape[2] if img.ndim == 3 else 1
+        # missing channels of the color are 0 as in cv2.putText
+        color = (tuple(color) + (0,) * channels)[:channels]
+        img[y0:y1, x0:x1][mask != 0] = color
+        return img